@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Iterable
+
+import discord
+import metrics
+from discord import Member, Role
+from discord.abc import GuildChannel, Messageable
+
+_Action = Callable[[], Awaitable]
+
+_logger = logging.getLogger(__name__)
+
+
+class _MemberEdit:
+    def __init__(self, member: Member):
+        self.member = member
+        self.nick: str | None = None
+        self.add_roles: dict[int, Role] = {}
+        self.remove_roles: dict[int, Role] = {}
+
+    def merge(self, nick: str | None, add_roles: Iterable[Role], remove_roles: Iterable[Role]):
+        if nick is not None:
+            self.nick = nick
+        for role in add_roles:
+            self.remove_roles.pop(role.id, None)
+            self.add_roles[role.id] = role
+        for role in remove_roles:
+            self.add_roles.pop(role.id, None)
+            self.remove_roles[role.id] = role
+
+    async def apply(self):
+        # The member queued with the edit may be stale by now, and only the queued changes are sent, so roles
+        # granted or removed in the meantime are left alone
+        member = self.member.guild.get_member(self.member.id)
+        if member is None:
+            return
+        current_role_ids = {role.id for role in member.roles}
+        if self.nick is not None and self.nick != member.nick:
+            await member.edit(nick=self.nick)
+        add_roles = [role for role_id, role in self.add_roles.items() if role_id not in current_role_ids]
+        if add_roles:
+            await member.add_roles(*add_roles)
+        remove_roles = [role for role_id, role in self.remove_roles.items() if role_id in current_role_ids]
+        if remove_roles:
+            await member.remove_roles(*remove_roles)
+
+
+class _MessageEdit:
+    def __init__(self, channel: GuildChannel, message_id: int):
+        self.channel = channel
+        self.message_id = message_id
+        self.content = ""
+
+    async def apply(self):
+        await self.channel.get_partial_message(self.message_id).edit(content=self.content)
+
+
+class ActionQueue:
+    def __init__(self, bucket_interval: float = 0.2, max_retries: int = 3, latency_samples: int = 1000):
+        self._bucket_interval = bucket_interval
+        self._max_retries = max_retries
+        self._buckets: dict[str, asyncio.Queue[tuple[float, _Action]]] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        # Keyed by guild and member ID, as the same user can be a member of several served guilds
+        self._member_edits: dict[tuple[int, int], _MemberEdit] = {}
+        # Members whose latest edit is being applied, retried or has failed
+        self._unsettled_members: set[tuple[int, int]] = set()
+        self._message_edits: dict[int, _MessageEdit] = {}
+        self._latencies: deque[float] = deque(maxlen=latency_samples)
+        self.stats = {"queued": 0, "merged": 0, "completed": 0, "retried": 0, "failed": 0}
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._buckets.values())
+
+    def metrics(self) -> dict[str, float]:
+        latencies = sorted(self._latencies)
+        return {
+            **self.stats,
+            "depth": self.depth,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p99": latencies[int(len(latencies) * 0.99)] if latencies else 0.0,
+        }
+
+    def edit_member(self, member: Member, *, nick: str = None, add_roles: Iterable[Role] = (),
+                    remove_roles: Iterable[Role] = ()):
+        pending = self._member_edits.get((member.guild.id, member.id))
+        if pending:
+            self.stats["merged"] += 1
+        else:
+            pending = self._member_edits[(member.guild.id, member.id)] = _MemberEdit(member)
+            self._enqueue(f"member:{member.guild.id}", lambda: self._apply_member_edit(pending))
+        pending.merge(nick, add_roles, remove_roles)
+
+    def has_pending_edit(self, guild_id: int, member_id: int) -> bool:
+        return (guild_id, member_id) in self._member_edits or (guild_id, member_id) in self._unsettled_members
+
+    def send(self, target: Messageable, content: str, on_sent: Callable[[discord.Message], None] = None):
+        bucket = f"channel:{target.id}" if isinstance(target, GuildChannel) else "direct_messages"
+        self._enqueue(bucket, lambda: self._send(target, content, on_sent))
+
+    def edit_message(self, channel: GuildChannel, message_id: int, content: str):
+        pending = self._message_edits.get(message_id)
+        if pending:
+            self.stats["merged"] += 1
+        else:
+            pending = self._message_edits[message_id] = _MessageEdit(channel, message_id)
+            self._enqueue(f"channel:{channel.id}", lambda: self._apply_message_edit(pending))
+        pending.content = content
+
+    def rename_role(self, role: Role, name: str):
+        self._enqueue(f"role:{role.guild.id}", lambda: role.edit(name=name))
+
+    def set_permissions(self, channel: GuildChannel, member: Member, overwrite: discord.PermissionOverwrite | None):
+        self._enqueue(f"channel:{channel.id}", lambda: channel.set_permissions(member, overwrite=overwrite))
+
+    async def drain(self):
+        await asyncio.gather(*(queue.join() for queue in self._buckets.values()))
+
+    def _enqueue(self, bucket: str, action: _Action):
+        if bucket not in self._buckets:
+            self._buckets[bucket] = asyncio.Queue()
+            self._workers[bucket] = asyncio.create_task(self._work(bucket, self._buckets[bucket]))
+        self._buckets[bucket].put_nowait((time.perf_counter(), action))
+        self.stats["queued"] += 1
+
+    @staticmethod
+    async def _send(target: Messageable, content: str, on_sent: Callable[[discord.Message], None] | None):
+        message = await target.send(content)
+        if on_sent:
+            on_sent(message)
+
+    async def _apply_message_edit(self, message_edit: _MessageEdit):
+        if self._message_edits.get(message_edit.message_id) is message_edit:
+            del self._message_edits[message_edit.message_id]
+        await message_edit.apply()
+
+    async def _apply_member_edit(self, member_edit: _MemberEdit):
+        key = (member_edit.member.guild.id, member_edit.member.id)
+        if self._member_edits.get(key) is member_edit:
+            del self._member_edits[key]
+        self._unsettled_members.add(key)
+        # A failed edit leaves the member dirty for reconciliation, which compares them again on its next pass
+        try:
+            await member_edit.apply()
+        finally:
+            self._unsettled_members.discard(key)
+
+    async def _work(self, bucket: str, queue: asyncio.Queue[tuple[float, _Action]]):
+        route = bucket.split(":", 1)[0]
+        while True:
+            enqueued_at, action = await queue.get()
+            started = time.perf_counter()
+            await self._run(action)
+            metrics.observe("bot_discord_rest_seconds", route, time.perf_counter() - started)
+            self._latencies.append(time.perf_counter() - enqueued_at)
+            queue.task_done()
+            await asyncio.sleep(self._bucket_interval)
+
+    async def _run(self, action: _Action):
+        for attempt in range(self._max_retries + 1):
+            try:
+                await action()
+                self.stats["completed"] += 1
+                return
+            except (discord.RateLimited, discord.HTTPException) as error:
+                retry_after = _retry_after(error, attempt)
+                if retry_after is None or attempt == self._max_retries:
+                    self.stats["failed"] += 1
+                    _logger.warning("Discord action failed: %s", error)
+                    return
+                self.stats["retried"] += 1
+                await asyncio.sleep(retry_after)
+            except Exception:
+                self.stats["failed"] += 1
+                _logger.exception("Discord action failed")
+                return
+
+
+def _retry_after(error: Exception, attempt: int) -> float | None:
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after
+    if error.status != 429:
+        return None
+    return float(error.response.headers.get("Retry-After", 2 ** attempt))
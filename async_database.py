@@ -0,0 +1,139 @@
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Union, Iterable, Callable
+
+import database
+import metrics
+
+# Every guild gets its own worker thread owning that guild's SQLite connection, so that queries and commits never
+# block the event loop and a busy guild cannot queue up work in front of another guild's lookups
+_executors: dict[int, ThreadPoolExecutor] = {}
+
+
+def _executor(guild_id: int) -> ThreadPoolExecutor:
+    if guild_id not in _executors:
+        if not database.is_served(guild_id):
+            raise database.UnservedGuild(guild_id)
+        _executors[guild_id] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"database-{guild_id}")
+    return _executors[guild_id]
+
+
+async def _call(guild_id: int, method_name: str, *args):
+    # Copying the context lets SQL statements run on the worker thread be traced to the calling interaction
+    context = contextvars.copy_context()
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor(guild_id), partial(context.run, _call_method, guild_id, method_name, *args))
+    finally:
+        metrics.record_database_call(method_name, time.perf_counter() - started)
+
+
+def _call_method(guild_id: int, method_name: str, *args):
+    return getattr(database.for_guild(guild_id), method_name)(*args)
+
+
+async def get_database(guild_id: int) -> database.GuildDatabase:
+    return await asyncio.get_running_loop().run_in_executor(_executor(guild_id), database.for_guild, guild_id)
+
+
+async def run_in_transaction(guild_id: int, function: Callable, *args):
+    return await _call(guild_id, "run_in_transaction", function, *args)
+
+
+async def add_user(guild_id: int, user_id: int):
+    await _call(guild_id, "add_user", user_id)
+
+
+async def add_users(guild_id: int, user_ids: Iterable[int]) -> int:
+    return await _call(guild_id, "add_users", list(user_ids))
+
+
+async def get_user(guild_id: int, member_id: int) -> database.User:
+    return await _call(guild_id, "get_user", member_id)
+
+
+async def get_users(guild_id: int, member_ids: Iterable[int]) -> list[database.User]:
+    return await _call(guild_id, "get_users", list(member_ids))
+
+
+async def get_memberships(guild_id: int, member_id: int) -> database.Memberships:
+    return await _call(guild_id, "get_memberships", member_id)
+
+
+async def update_user(guild_id: int, user: database.User):
+    await _call(guild_id, "update_user", user)
+
+
+async def delete_user(guild_id: int, user: database.User):
+    await _call(guild_id, "delete_user", user)
+
+
+async def get_org_names(guild_id: int) -> list[str]:
+    return await _call(guild_id, "get_org_names")
+
+
+async def get_org_ids(guild_id: int) -> set[int]:
+    return await _call(guild_id, "get_org_ids")
+
+
+async def search_org_names(guild_id: int, value: str, accept: Callable[[database.Org], bool] = None,
+                           limit: int = 25) -> list[str]:
+    return await _call(guild_id, "search_org_names", value, accept, limit)
+
+
+async def org_exists(guild_id: int, org_name: str) -> bool:
+    return await _call(guild_id, "org_exists", org_name)
+
+
+async def add_org(guild_id: int, org: database.Org):
+    await _call(guild_id, "add_org", org)
+
+
+async def get_org(guild_id: int, data: Union[str, int]) -> database.Org | None:
+    return await _call(guild_id, "get_org", data)
+
+
+async def delete_user_org(guild_id: int, user_org: database.OrgPermissions, user_id: int):
+    await _call(guild_id, "delete_user_org", user_org, user_id)
+
+
+async def get_pending(guild_id: int, org_id: int, after_user_id: int = 0, limit: int = 20) \
+        -> list[tuple[int, str | None]]:
+    return await _call(guild_id, "get_pending", org_id, after_user_id, limit)
+
+
+async def count_pending(guild_id: int, org_id: int) -> int:
+    return await _call(guild_id, "count_pending", org_id)
+
+
+async def approve_pending(guild_id: int, org_id: int) -> list[tuple[int, str | None]]:
+    return await _call(guild_id, "approve_pending", org_id)
+
+
+async def reject_pending(guild_id: int, org_id: int) -> list[tuple[int, str | None]]:
+    return await _call(guild_id, "reject_pending", org_id)
+
+
+async def get_approved_org_ids(guild_id: int) -> dict[int, set[int]]:
+    return await _call(guild_id, "get_approved_org_ids")
+
+
+async def set_memberships(guild_id: int, additions: Iterable[tuple[int, int]], removals: Iterable[tuple[int, int]]):
+    await _call(guild_id, "set_memberships", list(additions), list(removals))
+
+
+async def get_history(guild_id: int, user_id: int = None, org_id: int = None, before_id: int = None,
+                      limit: int = 20) -> list[tuple]:
+    return await _call(guild_id, "get_history", user_id, org_id, before_id, limit)
+
+
+async def compact_audit_log(guild_id: int, retention_days: float) -> int:
+    return await _call(guild_id, "compact_audit_log", retention_days)
+
+
+async def optimize(guild_id: int):
+    await _call(guild_id, "optimize")
@@ -0,0 +1,44 @@
+import random
+import sqlite3
+
+from benchmarks.stubs import StubGuild, StubMember, StubRole, StubChannel
+
+GUILD_ID = 1
+ADMIN_CHANNEL_ID = 2
+ADMIN_ID = 3
+_FIRST_ORG_ID = 1_000_000
+_FIRST_USER_ID = 10_000_000
+
+_NAME_PARTS = ("Helsinki", "Espoo", "Tampere", "Turku", "Oulu", "Lahti", "Kuopio", "Pori", "Vaasa", "Joensuu",
+               "North", "South", "East", "West", "Central", "Youth", "Student", "Senior", "Sports", "Culture")
+
+
+def seed_database(con: sqlite3.Connection, rng: random.Random, users: int, orgs: int, memberships: int) \
+        -> StubGuild:
+    guild = StubGuild(GUILD_ID)
+    guild.channels[ADMIN_CHANNEL_ID] = StubChannel(ADMIN_CHANNEL_ID, guild)
+    guild.add_member(StubMember(ADMIN_ID, guild, administrator=True))
+
+    org_rows = [(_FIRST_ORG_ID + index, f"{rng.choice(_NAME_PARTS)} {rng.choice(_NAME_PARTS)} {index}")
+                for index in range(orgs)]
+    for org_id, name in org_rows:
+        guild.add_role(StubRole(org_id, name))
+
+    user_rows = [(_FIRST_USER_ID + index, f"Member {index}") for index in range(users)]
+    membership_rows = []
+    for user_id, _ in user_rows:
+        member = StubMember(user_id, guild)
+        guild.add_member(member)
+        for org_id, _ in rng.sample(org_rows, min(orgs, rng.randint(0, memberships))):
+            permission_level = rng.choices((0, 1, 2, 3), weights=(20, 70, 8, 2))[0]
+            membership_rows.append((user_id, org_id, permission_level))
+            if permission_level > 0:
+                role = guild.get_role(org_id)
+                member.roles.append(role)
+                role.members.append(member)
+
+    con.executemany("INSERT INTO Orgs (ID, Name) VALUES (?, ?)", org_rows)
+    con.executemany("INSERT INTO Users (ID, Nick) VALUES (?, ?)", user_rows)
+    con.executemany("INSERT INTO OrgUsers (UserID, OrgID, PermissionLevel) VALUES (?, ?, ?)", membership_rows)
+    con.commit()
+    return guild
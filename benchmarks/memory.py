@@ -0,0 +1,45 @@
+import argparse
+import gc
+import os
+import random
+import tempfile
+import tracemalloc
+
+from benchmarks import fixtures
+
+
+def measure(name: str, users: int, function) -> object:
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<24}{allocated / 2 ** 20:>10.1f} MiB{allocated / users:>10.0f} B/user")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the memory used by the cached domain model.")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--orgs", type=int, default=500)
+    parser.add_argument("--memberships", type=int, default=3, help="Maximum org memberships per user")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as database_directory:
+        os.environ["DB_DIRECTORY"] = database_directory
+        import database
+
+        guild_database = database.for_guild(fixtures.GUILD_ID)
+        guild = fixtures.seed_database(guild_database.con, random.Random(arguments.seed), arguments.users,
+                                       arguments.orgs, arguments.memberships)
+        user_ids = [member.id for member in guild.members]
+        del guild
+
+        users = len(user_ids)
+        print(f"{'cache':<24}{'total':>14}{'per user':>16}")
+        measure("identity map", users, guild_database.load_cache)
+        measure("memberships", users, lambda: [guild_database.get_memberships(user_id) for user_id in user_ids])
+        measure("user objects", users, lambda: guild_database.get_users(user_ids))
+        guild_database.con.close()
@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import metrics
+from benchmarks import fixtures
+from benchmarks.stubs import StubInteraction, StubGuild
+
+
+class Benchmark:
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: list[float] = []
+        self.queries = 0
+        self._started = 0.0
+        self._finished = 0.0
+
+    async def measure(self, coroutine):
+        queries_before = metrics.total("bot_sql_statements_total")
+        started = time.perf_counter()
+        self._started = self._started or started
+        await coroutine
+        self._finished = time.perf_counter()
+        self.latencies.append(self._finished - started)
+        self.queries += metrics.total("bot_sql_statements_total") - queries_before
+
+    def report(self) -> str:
+        latencies = sorted(self.latencies)
+        p50 = statistics.median(latencies) * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        throughput = len(latencies) / (self._finished - self._started)
+        return f"{self.name:<24}{len(latencies):>8}{p50:>10.3f}{p99:>10.3f}{throughput:>12.1f}" \
+               f"{self.queries / len(latencies):>12.2f}"
+
+
+async def autocomplete_storm(main, guild: StubGuild, rng: random.Random, iterations: int) -> Benchmark:
+    benchmark = Benchmark("autocomplete keystrokes")
+    transformers = (main.JoinableOrganisation(), main.LeavableOrganisation(), main.ApprovableOrganisation())
+    while len(benchmark.latencies) < iterations:
+        member = rng.choice(guild.members)
+        transformer = rng.choice(transformers)
+        org_name = rng.choice(guild.roles).name
+        for length in range(1, min(len(org_name), 8) + 1):
+            interaction = StubInteraction(member, member=member)
+            await benchmark.measure(transformer.autocomplete(interaction, org_name[:length]))
+    return benchmark
+
+
+async def join_approve_burst(main, guild_database, guild: StubGuild, rng: random.Random, iterations: int) \
+        -> tuple[Benchmark, Benchmark]:
+    joins = Benchmark("join applications")
+    approvals = Benchmark("approvals")
+    admin = guild.get_member(fixtures.ADMIN_ID)
+    while len(approvals.latencies) < iterations:
+        member = rng.choice(guild.members[1:])
+        memberships = guild_database.get_memberships(member.id)
+        org = guild_database.get_org(rng.choice(guild.roles).id)
+        if org.org_id in memberships.orgs:
+            continue
+        await joins.measure(main.send_join_application(StubInteraction(member), org, f"Name {member.id}"))
+        org.role = guild.get_role(org.org_id)
+        await approvals.measure(main.approve.callback(StubInteraction(admin), member, org))
+    return joins, approvals
+
+
+async def permission_checks(main, guild: StubGuild, rng: random.Random, iterations: int) -> Benchmark:
+    benchmark = Benchmark("is_bot_admin checks")
+    predicate = main.add_org.checks[0]
+    for _ in range(iterations):
+        await benchmark.measure(predicate(StubInteraction(rng.choice(guild.members))))
+    return benchmark
+
+
+async def run(arguments: argparse.Namespace):
+    import async_database
+    import database
+    import main
+
+    rng = random.Random(arguments.seed)
+    guild_database = await async_database.get_database(fixtures.GUILD_ID)
+    guild = fixtures.seed_database(guild_database.con, rng, arguments.users, arguments.orgs, arguments.memberships)
+    guild_database.load_cache()
+    main.settings.set_admin_channel_id(fixtures.GUILD_ID, fixtures.ADMIN_CHANNEL_ID)
+
+    benchmarks = [
+        await autocomplete_storm(main, guild, rng, arguments.iterations),
+        *await join_approve_burst(main, guild_database, guild, rng, arguments.iterations),
+        await permission_checks(main, guild, rng, arguments.iterations),
+    ]
+    await asyncio.sleep(float(os.environ["APPLICATION_DIGEST_SECONDS"]))
+    await main.action_queue.drain()
+
+    print(f"{'scenario':<24}{'ops':>8}{'p50 ms':>10}{'p99 ms':>10}{'ops/s':>12}{'queries/op':>12}")
+    for benchmark in benchmarks:
+        print(benchmark.report())
+    print(f"database cache: {database.get_cache_stats()}")
+    print(f"action queue: {main.action_queue.metrics()}")
+
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the offline bot benchmarks against a seeded SQLite database.")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--orgs", type=int, default=500)
+    parser.add_argument("--memberships", type=int, default=3, help="Maximum org memberships per user")
+    parser.add_argument("--iterations", type=int, default=1_000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    with tempfile.TemporaryDirectory() as database_directory:
+        os.environ["DB_DIRECTORY"] = database_directory
+        os.environ["SETTINGS_PATH"] = os.path.join(database_directory, "settings.json")
+        os.environ.setdefault("GUILD", str(fixtures.GUILD_ID))
+        os.environ.setdefault("APPLICATION_DIGEST_SECONDS", "0")
+        os.makedirs("persistence", exist_ok=True)
+        asyncio.run(run(args))
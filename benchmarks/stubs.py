@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+
+class StubRole:
+    def __init__(self, role_id: int, name: str):
+        self.id = role_id
+        self.name = name
+        self.members: list["StubMember"] = []
+
+    def __repr__(self):
+        return f"StubRole '{self.name}', ID: {self.id}"
+
+
+class StubChannel:
+    def __init__(self, channel_id: int, guild: "StubGuild" = None):
+        self.id = channel_id
+        self.guild = guild
+        self.sent: list[str] = []
+
+    async def send(self, content: str = None, **_):
+        self.sent.append(content)
+        return self.get_partial_message(len(self.sent))
+
+    def get_partial_message(self, message_id: int) -> SimpleNamespace:
+        return SimpleNamespace(id=message_id, edit=lambda content=None, **_: self._edit(message_id, content))
+
+    async def set_permissions(self, *_, **__):
+        pass
+
+    async def _edit(self, message_id: int, content: str = None):
+        self.sent[message_id - 1] = content
+
+
+class StubMember:
+    def __init__(self, member_id: int, guild: "StubGuild", administrator: bool = False):
+        self.id = member_id
+        self.guild = guild
+        self.nick: str | None = None
+        self.roles: list[StubRole] = []
+        self.guild_permissions = SimpleNamespace(administrator=administrator)
+        self.mention = f"<@{member_id}>"
+
+    async def edit(self, *, nick: str = None, roles: list[StubRole] = None, **_):
+        if nick is not None:
+            self.nick = nick
+        if roles is not None:
+            self.roles = roles
+
+    async def add_roles(self, *roles: StubRole):
+        self.roles.extend(roles)
+
+    async def remove_roles(self, *roles: StubRole):
+        self.roles = [role for role in self.roles if role not in roles]
+
+    async def send(self, *_, **__):
+        pass
+
+
+class StubGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self.name = f"Guild {guild_id}"
+        self.members: list[StubMember] = []
+        self.roles: list[StubRole] = []
+        self.channels: dict[int, StubChannel] = {}
+        self._members_by_id: dict[int, StubMember] = {}
+        self._roles_by_id: dict[int, StubRole] = {}
+
+    @property
+    def member_count(self) -> int:
+        return len(self.members)
+
+    def add_member(self, member: StubMember):
+        self.members.append(member)
+        self._members_by_id[member.id] = member
+
+    def add_role(self, role: StubRole):
+        self.roles.append(role)
+        self._roles_by_id[role.id] = role
+
+    def get_member(self, member_id: int) -> StubMember | None:
+        return self._members_by_id.get(member_id)
+
+    def get_role(self, role_id: int) -> StubRole | None:
+        return self._roles_by_id.get(role_id)
+
+    def get_channel(self, channel_id: int) -> StubChannel | None:
+        return self.channels.get(channel_id)
+
+
+class StubResponse:
+    def __init__(self):
+        self.messages: list[str] = []
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def send_message(self, content: str = None, **_):
+        self.messages.append(content)
+        self._done = True
+
+    async def send_modal(self, *_):
+        self._done = True
+
+
+class StubInteraction:
+    def __init__(self, user: StubMember, channel: StubChannel = None, **namespace):
+        self.user = user
+        self.guild = user.guild
+        self.guild_id = user.guild.id
+        self.channel = channel
+        self.namespace = SimpleNamespace(**namespace)
+        self.response = StubResponse()
+        self.extras: dict = {}
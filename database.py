@@ -1,11 +1,29 @@
+import logging
 import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from enum import Enum
-from typing import Union
+from typing import Union, Iterable, Iterator, Callable
 
 from discord import Role
 
-con = sqlite3.connect("persistence/bot_db.sqlite")
+from org_index import OrgNameIndex
+
+# Each pragma can be overridden with an environment variable, e.g. DB_SYNCHRONOUS=FULL
+_CONNECTION_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": "-16000",
+    "mmap_size": "67108864",
+    "foreign_keys": "ON",
+}
+LEGACY_DATABASE_PATH = "persistence/bot_db.sqlite"
+_DATABASE_DIRECTORY = os.getenv("DB_DIRECTORY", "persistence/guilds")
+
+_logger = logging.getLogger(__name__)
 
 
 class DbEntryStatus(Enum):
@@ -15,6 +33,8 @@ class DbEntryStatus(Enum):
 
 
 class Org:
+    __slots__ = ("_org_id", "_name", "status", "role")
+
     def __init__(self, org_id: int, name: str, status: DbEntryStatus = DbEntryStatus.UNCHANGED):
         self._org_id = org_id
         self._name = name
@@ -34,11 +54,14 @@ class Org:
 
     @name.setter
     def name(self, name: str):
-        self.status = DbEntryStatus.CHANGED
+        if self.status == DbEntryStatus.UNCHANGED and name != self._name:
+            self.status = DbEntryStatus.CHANGED
         self._name = name
 
 
 class OrgPermissions:
+    __slots__ = ("org", "_permission_level", "status")
+
     def __init__(self, org: Org, permission_level: int = 0, status: DbEntryStatus = DbEntryStatus.NEW):
         self.org = org
         self._permission_level = permission_level
@@ -53,11 +76,14 @@ class OrgPermissions:
 
     @permission_level.setter
     def permission_level(self, permission_level: int):
-        self.status = DbEntryStatus.CHANGED
+        if self.status == DbEntryStatus.UNCHANGED and permission_level != self._permission_level:
+            self.status = DbEntryStatus.CHANGED
         self._permission_level = permission_level
 
 
 class User:
+    __slots__ = ("_user_id", "_nick", "orgs", "status")
+
     def __init__(self, user_id: int, nick: str = None, *orgs: OrgPermissions,
                  status: DbEntryStatus = DbEntryStatus.UNCHANGED):
         self._user_id = user_id
@@ -72,86 +98,658 @@ class User:
     def user_id(self):
         return self._user_id
 
-    @user_id.setter
-    def user_id(self, user_id: int):
-        self.status = DbEntryStatus.CHANGED
-        self._user_id = user_id
-
     @property
     def nick(self):
         return self._nick
 
     @nick.setter
     def nick(self, nick: str):
-        self.status = DbEntryStatus.CHANGED
+        if self.status == DbEntryStatus.UNCHANGED and nick != self._nick:
+            self.status = DbEntryStatus.CHANGED
         self._nick = nick
 
+    @property
+    def changed_orgs(self) -> list[OrgPermissions]:
+        return [org_user for org_user in self.orgs if org_user.status != DbEntryStatus.UNCHANGED]
+
+
+_NO_ORGS = frozenset()
+
+
+class Memberships:
+    __slots__ = ("_org_levels", "orgs", "pending", "members", "max_level", "_at_least")
 
-def init_databases():
-    for table in ("orgs", "users", "org_users"):
-        with open(os.path.join("sqlscripts", f"create_{table}.sql"), "r", encoding="utf-8") as sql_script:
-            con.execute(sql_script.read())
+    def __init__(self, org_levels: dict[int, int]):
+        self._org_levels = dict(org_levels)
+        self.orgs = frozenset(self._org_levels) if org_levels else _NO_ORGS
+        self.pending = frozenset(org_id for org_id, level in self._org_levels.items() if level == 0) or _NO_ORGS
+        self.members = self.orgs - self.pending if self.pending else self.orgs
+        self.max_level = max(self._org_levels.values(), default=0)
+        self._at_least: dict[int, frozenset[int]] | None = None
+
+    def __repr__(self):
+        return f"Memberships {self._org_levels}"
+
+    def level(self, org_id: int) -> int | None:
+        return self._org_levels.get(org_id)
+
+    def at_least(self, permission_level: int) -> frozenset[int]:
+        if self._at_least is None:
+            self._at_least = {}
+        if permission_level not in self._at_least:
+            self._at_least[permission_level] = frozenset(org_id for org_id, level in self._org_levels.items()
+                                                         if level >= permission_level)
+        return self._at_least[permission_level]
+
+
+_NO_MEMBERSHIPS = Memberships({})
+
+
+_MIGRATIONS_DIRECTORY = os.path.join("sqlscripts", "migrations")
+_HOT_QUERIES = (
+    "SELECT ID, Name FROM Orgs WHERE Orgs.ID = ?",
+    "SELECT ID, Name FROM Orgs WHERE Orgs.Name = ?",
+    "SELECT EXISTS(SELECT 1 FROM Orgs WHERE Orgs.Name = ?)",
+    "SELECT Users.ID, Users.Nick, Orgs.ID, Orgs.Name, OrgUsers.PermissionLevel FROM Users "
+    "LEFT JOIN OrgUsers ON OrgUsers.UserID = Users.ID LEFT JOIN Orgs ON Orgs.ID = OrgUsers.OrgID WHERE Users.ID = ?",
+    "SELECT Users.ID, Users.Nick, Orgs.ID, Orgs.Name, OrgUsers.PermissionLevel FROM Users "
+    "LEFT JOIN OrgUsers ON OrgUsers.UserID = Users.ID LEFT JOIN Orgs ON Orgs.ID = OrgUsers.OrgID "
+    "WHERE Users.ID IN (?, ?)",
+    "UPDATE Users SET Nick = ? WHERE ID = ?",
+    "UPDATE OrgUsers SET PermissionLevel = ? WHERE OrgID = ? AND UserID = ?",
+    "DELETE FROM OrgUsers WHERE OrgID = ? AND UserID = ?",
+    "DELETE FROM OrgUsers WHERE UserID = ?",
+    "DELETE FROM Users WHERE ID = ?",
+    "SELECT UserID FROM OrgUsers WHERE OrgID = ?",
+    "SELECT OrgUsers.UserID, Users.Nick FROM OrgUsers JOIN Users ON Users.ID = OrgUsers.UserID "
+    "WHERE OrgUsers.OrgID = ? AND OrgUsers.PermissionLevel = 0 AND OrgUsers.UserID > ? "
+    "ORDER BY OrgUsers.UserID LIMIT ?",
+    "SELECT COUNT(*) FROM OrgUsers WHERE OrgID = ? AND PermissionLevel = 0",
+    "SELECT ID, Time, ActorID, Action, UserID, OrgID, PermissionLevel, Detail FROM AuditLog "
+    "WHERE UserID = ? AND ID < ? ORDER BY ID DESC LIMIT ?",
+    "SELECT ID, Time, ActorID, Action, UserID, OrgID, PermissionLevel, Detail FROM AuditLog "
+    "WHERE OrgID = ? AND ID < ? ORDER BY ID DESC LIMIT ?",
+    "SELECT ID FROM AuditLog WHERE Time < ? LIMIT ?",
+)
+_USER_QUERY = "SELECT Users.ID, Users.Nick, Orgs.ID, Orgs.Name, OrgUsers.PermissionLevel FROM Users " \
+              "LEFT JOIN OrgUsers ON OrgUsers.UserID = Users.ID LEFT JOIN Orgs ON Orgs.ID = OrgUsers.OrgID"
+_AUDIT_COLUMNS = "ID, Time, ActorID, Action, UserID, OrgID, PermissionLevel, Detail"
+_BATCH_SIZE = 500
+_MAX_IMPORT_ERRORS = 10
+
+
+class ImportDiff:
+    def __init__(self):
+        self.counts = {kind: {"added": 0, "changed": 0, "unchanged": 0} for kind in ("org", "user", "membership")}
+        self.errors: list[str] = []
+        self.error_count = 0
+        self.renamed_orgs: dict[int, str] = {}
+
+    def __repr__(self):
+        return f"ImportDiff {self.counts}, errors: {self.error_count}"
+
+    def add_error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < _MAX_IMPORT_ERRORS:
+            self.errors.append(f"line {line}: {message}")
+
+    def summary(self) -> str:
+        lines = [f"{kind}: " + ", ".join(f"{count} {action}" for action, count in counts.items())
+                 for kind, counts in self.counts.items()]
+        if self.error_count:
+            lines.append(f"{self.error_count} errors:")
+            lines.extend(self.errors)
+        return "\n".join(lines)
 
 
-def add_user(user_id: int):
-    con.execute("INSERT INTO Users (ID) VALUES (?)", (user_id,))
-    con.commit()
+class ImportRejected(Exception):
+    def __init__(self, diff: ImportDiff):
+        super().__init__(f"Import rejected with {diff.error_count} errors")
+        self.diff = diff
 
 
-def get_user(member_id: int) -> User:
-    if con.execute("SELECT EXISTS(SELECT 1 FROM Users WHERE Users.ID = ?)", (member_id,)).fetchone()[0] == 0:
-        add_user(member_id)
-    data = con.execute("SELECT ID, Nick FROM Users WHERE Users.ID = ?", (member_id,)).fetchone()
-    org_data = con.execute("SELECT OrgID, PermissionLevel FROM OrgUsers WHERE OrgUsers.UserID = ?", (member_id,))\
-        .fetchall()
-    orgs = [get_org(data_point[0]) for data_point in org_data]
-    org_permissions = [OrgPermissions(org, data_point[1], DbEntryStatus.UNCHANGED) for org, data_point in zip(orgs, org_data)]
-    return User(*data, *org_permissions)
+class UnservedGuild(LookupError):
+    def __init__(self, guild_id: int):
+        super().__init__(f"Guild {guild_id} is not served by this process")
+        self.guild_id = guild_id
 
 
-def update_user(user: User):
-    if user.status == DbEntryStatus.CHANGED:
-        con.execute("UPDATE Users SET Nick = ? WHERE ID = ?", (user.nick, user.user_id))
-    for org_user in user.orgs:
-        if org_user.status == DbEntryStatus.NEW:
-            con.execute("INSERT INTO OrgUsers (OrgID, UserID, PermissionLevel) VALUES (?, ?, ?)",
-                        (org_user.org.org_id, user.user_id, org_user.permission_level))
-        elif org_user.status == DbEntryStatus.CHANGED:
-            con.execute("UPDATE OrgUsers SET PermissionLevel = ? WHERE OrgID = ? AND UserID = ?",
-                        (org_user.permission_level, org_user.org.org_id, user.user_id))
+# The Discord user whose command is being handled, recorded as the actor of audit log entries
+audit_actor: ContextVar[int | None] = ContextVar("audit_actor", default=None)
+connection_hooks: list[Callable[[sqlite3.Connection], None]] = []
+_user_listeners: list[Callable[[int, int], None]] = []
+_databases: dict[int, "GuildDatabase"] = {}
+_databases_lock = threading.Lock()
+# None serves every guild, for the command line tools and benchmarks
+_served_guild_ids: set[int] | None = None
 
-    con.commit()
 
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, check_same_thread=False)
+    for pragma, default in _CONNECTION_PROFILE.items():
+        value = os.getenv(f"DB_{pragma.upper()}", default)
+        connection.execute(f"PRAGMA {pragma} = {value}")
+    for hook in connection_hooks:
+        hook(connection)
+    return connection
 
-def delete_user(user: User):
-    con.execute("DELETE FROM Users WHERE ID = ?", (user.user_id,))
-    con.commit()
 
+def database_path(guild_id: int) -> str:
+    return os.path.join(_DATABASE_DIRECTORY, f"{guild_id}.sqlite")
 
-def get_org_names() -> list[str]:
-    rows = con.execute("SELECT Name FROM Orgs")
-    return [row[0] for row in rows]
 
+def migrate_legacy_database(guild_id: int):
+    if os.path.exists(LEGACY_DATABASE_PATH) and not os.path.exists(database_path(guild_id)):
+        os.makedirs(_DATABASE_DIRECTORY, exist_ok=True)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(LEGACY_DATABASE_PATH + suffix):
+                os.replace(LEGACY_DATABASE_PATH + suffix, database_path(guild_id) + suffix)
 
-def org_exists(org_name: str):
-    return con.execute("SELECT EXISTS(SELECT 1 FROM Orgs WHERE Orgs.Name = ?)", (org_name,)).fetchone()[0] == 1
 
+def serve_guilds(guild_ids: Iterable[int]):
+    global _served_guild_ids
+    _served_guild_ids = set(guild_ids)
 
-def add_org(org: Org):
-    con.execute("INSERT INTO Orgs (ID, Name) VALUES (?, ?)", (org.org_id, org.name))
-    con.commit()
 
+def is_served(guild_id: int) -> bool:
+    return _served_guild_ids is None or guild_id in _served_guild_ids
 
-def get_org(data: Union[str, int]):
-    if type(data) == str:
-        org_data = con.execute("SELECT ID, Name FROM Orgs WHERE Orgs.Name = ?", (data,)).fetchone()
-    else:
-        org_data = con.execute("SELECT ID, Name FROM Orgs WHERE Orgs.ID = ?", (data,)).fetchone()
 
-    if not org_data:
-        return None
-    return Org(*org_data)
+def for_guild(guild_id: int) -> "GuildDatabase":
+    with _databases_lock:
+        if guild_id not in _databases:
+            if not is_served(guild_id):
+                raise UnservedGuild(guild_id)
+            os.makedirs(_DATABASE_DIRECTORY, exist_ok=True)
+            guild_database = GuildDatabase(guild_id, connect(database_path(guild_id)))
+            guild_database.init_database()
+            guild_database.load_cache()
+            _databases[guild_id] = guild_database
+        return _databases[guild_id]
 
 
-def delete_user_org(user_org: OrgPermissions, user_id: int):
-    con.execute("DELETE FROM OrgUsers WHERE OrgID = ? AND UserID = ?", (user_org.org.org_id, user_id))
+def add_user_listener(listener: Callable[[int, int], None]):
+    _user_listeners.append(listener)
+
+
+def get_cache_stats() -> dict[str, int]:
+    return {f"{guild_id}.{key}": value for guild_id, guild_database in list(_databases.items())
+            for key, value in guild_database.get_cache_stats().items()}
+
+
+class GuildDatabase:
+    def __init__(self, guild_id: int, con: sqlite3.Connection):
+        self.guild_id = guild_id
+        self.con = con
+        self.cache_stats = {"user_hits": 0, "user_misses": 0, "org_hits": 0, "org_misses": 0}
+        self._orgs_by_id: dict[int, Org] = {}
+        self._orgs_by_name: dict[str, Org] = {}
+        self._users: dict[int, tuple[str | None, dict[int, int]]] = {}
+        self._memberships: dict[int, Memberships] = {}
+        self._org_index = OrgNameIndex()
+        self._cache_loaded = False
+        self._transaction_depth = 0
+
+    def __repr__(self):
+        return f"GuildDatabase {self.guild_id}"
+
+    def init_database(self):
+        for table in ("orgs", "users", "org_users"):
+            with open(os.path.join("sqlscripts", f"create_{table}.sql"), "r", encoding="utf-8") as sql_script:
+                self.con.execute(sql_script.read())
+        self.migrate()
+        for query_plan in self.check_query_plans():
+            _logger.warning("Query plan warning: %s", query_plan)
+
+    @contextmanager
+    def transaction(self):
+        self._transaction_depth += 1
+        try:
+            yield self.con
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.con.rollback()
+                if self._cache_loaded:
+                    self.load_cache()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self.con.commit()
+
+    def run_in_transaction(self, function: Callable, *args):
+        with self.transaction():
+            return function(self, *args)
+
+    def get_schema_version(self) -> int:
+        return self.con.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self):
+        current_version = self.get_schema_version()
+        # Shipped migrations rebuild tables holding rows from before foreign keys were enforced, and the pragma
+        # cannot be changed inside the migration's transaction
+        foreign_keys = self.con.execute("PRAGMA foreign_keys").fetchone()[0]
+        self.con.execute("PRAGMA foreign_keys = OFF")
+        try:
+            for file_name in sorted(os.listdir(_MIGRATIONS_DIRECTORY)):
+                version = int(file_name.split("_", 1)[0])
+                if version <= current_version:
+                    continue
+                with open(os.path.join(_MIGRATIONS_DIRECTORY, file_name), "r", encoding="utf-8") as sql_script:
+                    script = sql_script.read()
+                try:
+                    self.con.executescript(f"BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;")
+                except sqlite3.Error:
+                    self.con.rollback()
+                    raise
+                current_version = version
+        finally:
+            self.con.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+
+    def check_query_plans(self) -> list[str]:
+        table_scans = []
+        for query in _HOT_QUERIES:
+            for row in self.con.execute(f"EXPLAIN QUERY PLAN {query}", (None,) * query.count("?")):
+                if row[-1].startswith("SCAN") and row[-1] != "SCAN CONSTANT ROW":
+                    table_scans.append(f"'{query}': {row[-1]}")
+        return table_scans
+
+    def load_cache(self):
+        # The new maps are built aside and swapped in, so readers never see a half-filled cache
+        orgs_by_id, orgs_by_name, users = {}, {}, {}
+        for org_id, name in self.con.execute("SELECT ID, Name FROM Orgs"):
+            orgs_by_id[org_id] = orgs_by_name[name] = Org(org_id, name)
+        for user_id, nick in self.con.execute("SELECT ID, Nick FROM Users"):
+            users[user_id] = (nick, {})
+        for user_id, org_id, permission_level in self.con.execute(
+                "SELECT UserID, OrgID, PermissionLevel FROM OrgUsers"):
+            if user_id in users and org_id in orgs_by_id:
+                users[user_id][1][org_id] = permission_level
+        self._org_index.reset(orgs_by_name)
+        self._orgs_by_id, self._orgs_by_name, self._users, self._memberships = orgs_by_id, orgs_by_name, users, {}
+        self._cache_loaded = True
+
+    def get_cache_stats(self) -> dict[str, int]:
+        return {**self.cache_stats, "users": len(self._users), "orgs": len(self._orgs_by_id)}
+
+    def _cache_org(self, org: Org):
+        self._orgs_by_id[org.org_id] = org
+        self._orgs_by_name[org.name] = org
+        self._org_index.add(org.name)
+
+    def _invalidate_user(self, user_id: int):
+        self._memberships.pop(user_id, None)
+        for listener in _user_listeners:
+            listener(self.guild_id, user_id)
+
+    def _cache_user_changes(self, user: User, changed_orgs: list[OrgPermissions]):
+        _, org_levels = self._users.get(user.user_id, (user.nick, {}))
+        if user.status != DbEntryStatus.UNCHANGED or user.user_id not in self._users:
+            self._users[user.user_id] = (user.nick, org_levels)
+        for org_user in changed_orgs:
+            org_levels[org_user.org.org_id] = org_user.permission_level
+        self._invalidate_user(user.user_id)
+
+    def add_user(self, user_id: int):
+        self.add_users((user_id,))
+
+    def add_users(self, user_ids: Iterable[int]) -> int:
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in self._users]
+        if not missing:
+            return 0
+        changes_before = self.con.total_changes
+        with self.transaction():
+            for start in range(0, len(missing), _BATCH_SIZE):
+                self.con.executemany("INSERT OR IGNORE INTO Users (ID) VALUES (?)",
+                                     ((user_id,) for user_id in missing[start:start + _BATCH_SIZE]))
+            if self._cache_loaded:
+                for user_id in missing:
+                    self._users[user_id] = (None, {})
+                    self._invalidate_user(user_id)
+        return self.con.total_changes - changes_before
+
+    def get_user(self, member_id: int) -> User:
+        if member_id in self._users:
+            self.cache_stats["user_hits"] += 1
+        else:
+            self.cache_stats["user_misses"] += 1
+            if not self._cache_loaded:
+                self._hydrate_users(self.con.execute(f"{_USER_QUERY} WHERE Users.ID = ?", (member_id,)))
+            if member_id not in self._users:
+                return User(member_id, status=DbEntryStatus.NEW)
+        return self._build_user(member_id)
+
+    def get_users(self, member_ids: Iterable[int]) -> list[User]:
+        member_ids = list(dict.fromkeys(member_ids))
+        missing = [member_id for member_id in member_ids if member_id not in self._users]
+        self.cache_stats["user_hits"] += len(member_ids) - len(missing)
+        self.cache_stats["user_misses"] += len(missing)
+        if missing and not self._cache_loaded:
+            for start in range(0, len(missing), _BATCH_SIZE):
+                batch = missing[start:start + _BATCH_SIZE]
+                placeholders = ", ".join("?" * len(batch))
+                self._hydrate_users(self.con.execute(f"{_USER_QUERY} WHERE Users.ID IN ({placeholders})", batch))
+        return [self._build_user(member_id) for member_id in member_ids if member_id in self._users]
+
+    def get_memberships(self, member_id: int) -> Memberships:
+        if member_id not in self._memberships:
+            if member_id not in self._users and not self._cache_loaded:
+                self._hydrate_users(self.con.execute(f"{_USER_QUERY} WHERE Users.ID = ?", (member_id,)))
+            org_levels = self._users[member_id][1] if member_id in self._users else None
+            self._memberships[member_id] = Memberships(org_levels) if org_levels else _NO_MEMBERSHIPS
+        return self._memberships[member_id]
+
+    def _build_user(self, member_id: int) -> User:
+        nick, org_levels = self._users[member_id]
+        org_permissions = [OrgPermissions(self._orgs_by_id[org_id], permission_level, DbEntryStatus.UNCHANGED)
+                           for org_id, permission_level in org_levels.items()]
+        return User(member_id, nick, *org_permissions)
+
+    def _hydrate_users(self, rows: Iterable[tuple]):
+        hydrated: dict[int, tuple[str | None, dict[int, int]]] = {}
+        for user_id, nick, org_id, org_name, permission_level in rows:
+            _, org_levels = hydrated.setdefault(user_id, (nick, {}))
+            if org_id is None:
+                continue
+            if org_id not in self._orgs_by_id:
+                self._cache_org(Org(org_id, org_name))
+            org_levels[org_id] = permission_level
+        self._users.update(hydrated)
+        for user_id in hydrated:
+            self._invalidate_user(user_id)
+
+    def update_user(self, user: User):
+        changed_orgs = user.changed_orgs
+        if user.status == DbEntryStatus.UNCHANGED and not changed_orgs:
+            return
+        with self.transaction():
+            if user.status == DbEntryStatus.NEW:
+                self.con.execute("INSERT OR IGNORE INTO Users (ID, Nick) VALUES (?, ?)", (user.user_id, user.nick))
+            elif user.status == DbEntryStatus.CHANGED:
+                self.con.execute("UPDATE Users SET Nick = ? WHERE ID = ?", (user.nick, user.user_id))
+            stored_levels = self._org_levels(user.user_id)
+            audit_entries = [(_membership_action(stored_levels.get(org_user.org.org_id), org_user.permission_level),
+                              user.user_id, org_user.org.org_id, org_user.permission_level, None)
+                             for org_user in changed_orgs]
+            if user.status == DbEntryStatus.CHANGED:
+                audit_entries.append(("nick_changed", user.user_id, None, None, user.nick))
+            self._audit_many(audit_entries)
+            for org_user in changed_orgs:
+                if org_user.status == DbEntryStatus.NEW:
+                    self.con.execute("INSERT INTO OrgUsers (OrgID, UserID, PermissionLevel) VALUES (?, ?, ?) "
+                                     "ON CONFLICT (UserID, OrgID) DO UPDATE "
+                                     "SET PermissionLevel = excluded.PermissionLevel",
+                                     (org_user.org.org_id, user.user_id, org_user.permission_level))
+                else:
+                    self.con.execute("UPDATE OrgUsers SET PermissionLevel = ? WHERE OrgID = ? AND UserID = ?",
+                                     (org_user.permission_level, org_user.org.org_id, user.user_id))
+            self._cache_user_changes(user, changed_orgs)
+        user.status = DbEntryStatus.UNCHANGED
+        for org_user in changed_orgs:
+            org_user.status = DbEntryStatus.UNCHANGED
+
+    def delete_user(self, user: User):
+        with self.transaction():
+            self._audit_many((_removal_action(permission_level), user.user_id, org_id, permission_level, None)
+                             for org_id, permission_level in self._org_levels(user.user_id).items())
+            self._audit("user_deleted", user.user_id)
+            self.con.execute("DELETE FROM OrgUsers WHERE UserID = ?", (user.user_id,))
+            self.con.execute("DELETE FROM Users WHERE ID = ?", (user.user_id,))
+            self._users.pop(user.user_id, None)
+            self._invalidate_user(user.user_id)
+
+    def get_approved_org_ids(self) -> dict[int, set[int]]:
+        if self._cache_loaded:
+            rows = ((user_id, org_id) for user_id, (_, org_levels) in self._users.items()
+                    for org_id, level in org_levels.items() if level >= 1)
+        else:
+            rows = self.con.execute("SELECT UserID, OrgID FROM OrgUsers WHERE PermissionLevel >= 1")
+        approved = {}
+        for user_id, org_id in rows:
+            approved.setdefault(user_id, set()).add(org_id)
+        return approved
+
+    def set_memberships(self, additions: Iterable[tuple[int, int]], removals: Iterable[tuple[int, int]]):
+        additions, removals = list(additions), list(removals)
+        with self.transaction():
+            self.add_users(user_id for user_id, _ in additions)
+            self.con.executemany("INSERT INTO OrgUsers (UserID, OrgID, PermissionLevel) VALUES (?, ?, 1) "
+                                 "ON CONFLICT (UserID, OrgID) DO UPDATE SET PermissionLevel = MAX(PermissionLevel, 1)",
+                                 additions)
+            self.con.executemany("DELETE FROM OrgUsers WHERE UserID = ? AND OrgID = ?", removals)
+            self._audit_many([*(("reconciled", user_id, org_id, 1, "added") for user_id, org_id in additions),
+                              *(("reconciled", user_id, org_id, None, "removed") for user_id, org_id in removals)])
+            for user_id, org_id in additions:
+                if user_id in self._users:
+                    org_levels = self._users[user_id][1]
+                    org_levels[org_id] = max(org_levels.get(org_id, 1), 1)
+                self._invalidate_user(user_id)
+            for user_id, org_id in removals:
+                if user_id in self._users:
+                    self._users[user_id][1].pop(org_id, None)
+                self._invalidate_user(user_id)
+
+    def export_records(self) -> Iterator[tuple]:
+        for org_id, name in self.con.execute("SELECT ID, Name FROM Orgs ORDER BY ID"):
+            yield "org", org_id, name, None, None
+        for user_id, nick in self.con.execute("SELECT ID, Nick FROM Users ORDER BY ID"):
+            yield "user", user_id, nick, None, None
+        for user_id, org_id, permission_level in self.con.execute(
+                "SELECT UserID, OrgID, PermissionLevel FROM OrgUsers ORDER BY UserID, OrgID"):
+            yield "membership", user_id, None, org_id, permission_level
+
+    def import_records(self, records: Iterable[tuple[int, tuple | str]], dry_run: bool = False) -> ImportDiff:
+        if not self._cache_loaded:
+            self.load_cache()
+        diff = ImportDiff()
+        imported_orgs: dict[int, str] = {}
+        imported_org_ids: dict[str, int] = {}
+        touched_users: set[int] = set()
+        batch = {"org": [], "user": [], "membership": []}
+        with self.transaction():
+            for line, record in records:
+                if isinstance(record, str):
+                    diff.add_error(line, record)
+                    continue
+                action = self._diff_record(record, imported_orgs, imported_org_ids)
+                if action not in diff.counts[record[0]]:
+                    diff.add_error(line, action)
+                    continue
+                diff.counts[record[0]][action] += 1
+                if record[0] == "org":
+                    if imported_org_ids.get(imported_orgs.get(record[1])) == record[1]:
+                        del imported_org_ids[imported_orgs[record[1]]]
+                    imported_orgs[record[1]] = record[2]
+                    imported_org_ids[record[2]] = record[1]
+                    if action == "changed":
+                        diff.renamed_orgs[record[1]] = record[2]
+                else:
+                    touched_users.add(record[1])
+                if action != "unchanged":
+                    batch[record[0]].append(record)
+                if sum(map(len, batch.values())) >= _BATCH_SIZE:
+                    self._write_import_batch(batch, dry_run or diff.error_count > 0)
+            self._write_import_batch(batch, dry_run or diff.error_count > 0)
+            if diff.error_count and not dry_run:
+                raise ImportRejected(diff)
+            if not dry_run:
+                self._audit("imported", detail="; ".join(
+                    f"{kind}: {counts['added']} added, {counts['changed']} changed"
+                    for kind, counts in diff.counts.items()))
+                self.load_cache()
+                for user_id in touched_users:
+                    self._invalidate_user(user_id)
+        return diff
+
+    def _diff_record(self, record: tuple, imported_orgs: dict[int, str], imported_org_ids: dict[str, int]) -> str:
+        kind, record_id, name, org_id, permission_level = record
+        if kind == "org":
+            existing = self._orgs_by_name.get(name)
+            if existing and existing.org_id != record_id or imported_org_ids.get(name, record_id) != record_id:
+                return f"org name '{name}' is already used by another org"
+            current = imported_orgs.get(record_id) or (self._orgs_by_id[record_id].name
+                                                       if record_id in self._orgs_by_id else None)
+            return "added" if current is None else "changed" if current != name else "unchanged"
+        if kind == "user":
+            if record_id not in self._users:
+                return "added"
+            return "changed" if name is not None and name != self._users[record_id][0] else "unchanged"
+        if org_id not in self._orgs_by_id and org_id not in imported_orgs:
+            return f"unknown org {org_id}, orgs have to be listed before their memberships"
+        current_level = self._users.get(record_id, (None, {}))[1].get(org_id)
+        return "added" if current_level is None else "changed" if current_level != permission_level else "unchanged"
+
+    def _write_import_batch(self, batch: dict[str, list[tuple]], discard: bool):
+        if not discard:
+            self.con.executemany("INSERT INTO Orgs (ID, Name) VALUES (?, ?) "
+                                 "ON CONFLICT (ID) DO UPDATE SET Name = excluded.Name",
+                                 ((org_id, name) for _, org_id, name, _, _ in batch["org"]))
+            self.con.executemany("INSERT INTO Users (ID, Nick) VALUES (?, ?) "
+                                 "ON CONFLICT (ID) DO UPDATE SET Nick = COALESCE(excluded.Nick, Nick)",
+                                 ((user_id, nick) for _, user_id, nick, _, _ in batch["user"]))
+            self.con.executemany("INSERT OR IGNORE INTO Users (ID) VALUES (?)",
+                                 ((user_id,) for _, user_id, _, _, _ in batch["membership"]))
+            self.con.executemany("INSERT INTO OrgUsers (UserID, OrgID, PermissionLevel) VALUES (?, ?, ?) "
+                                 "ON CONFLICT (UserID, OrgID) DO UPDATE SET PermissionLevel = excluded.PermissionLevel",
+                                 ((user_id, org_id, level) for _, user_id, _, org_id, level in batch["membership"]))
+        for records in batch.values():
+            records.clear()
+
+    def get_org_names(self) -> list[str]:
+        if self._cache_loaded:
+            return list(self._orgs_by_name)
+        rows = self.con.execute("SELECT Name FROM Orgs")
+        return [row[0] for row in rows]
+
+    def get_org_ids(self) -> set[int]:
+        if self._cache_loaded:
+            return set(self._orgs_by_id)
+        return {row[0] for row in self.con.execute("SELECT ID FROM Orgs")}
+
+    def search_org_names(self, value: str, accept: Callable[[Org], bool] = None, limit: int = 25) -> list[str]:
+        return self._org_index.search(value, accept and (lambda org_name: accept(self._orgs_by_name[org_name])),
+                                      limit)
+
+    def org_exists(self, org_name: str):
+        if self._cache_loaded:
+            return org_name in self._orgs_by_name
+        return self.con.execute("SELECT EXISTS(SELECT 1 FROM Orgs WHERE Orgs.Name = ?)",
+                                (org_name,)).fetchone()[0] == 1
+
+    def add_org(self, org: Org):
+        with self.transaction():
+            self.con.execute("INSERT INTO Orgs (ID, Name) VALUES (?, ?)", (org.org_id, org.name))
+            self._audit("org_added", org_id=org.org_id, detail=org.name)
+            self._cache_org(org)
+
+    def get_org(self, data: Union[str, int]):
+        org = self._orgs_by_name.get(data) if type(data) == str else self._orgs_by_id.get(data)
+        if org or self._cache_loaded:
+            self.cache_stats["org_hits" if org else "org_misses"] += 1
+            return org
+
+        self.cache_stats["org_misses"] += 1
+        if type(data) == str:
+            org_data = self.con.execute("SELECT ID, Name FROM Orgs WHERE Orgs.Name = ?", (data,)).fetchone()
+        else:
+            org_data = self.con.execute("SELECT ID, Name FROM Orgs WHERE Orgs.ID = ?", (data,)).fetchone()
+
+        if not org_data:
+            return None
+        org = Org(*org_data)
+        self._cache_org(org)
+        return org
+
+    def delete_user_org(self, user_org: OrgPermissions, user_id: int):
+        with self.transaction():
+            permission_level = self._org_levels(user_id).get(user_org.org.org_id, user_org.permission_level)
+            self._audit(_removal_action(permission_level), user_id, user_org.org.org_id, permission_level)
+            self.con.execute("DELETE FROM OrgUsers WHERE OrgID = ? AND UserID = ?", (user_org.org.org_id, user_id))
+            if user_id in self._users:
+                self._users[user_id][1].pop(user_org.org.org_id, None)
+            self._invalidate_user(user_id)
+
+    def get_pending(self, org_id: int, after_user_id: int = 0, limit: int = 20) -> list[tuple[int, str | None]]:
+        return self.con.execute("SELECT OrgUsers.UserID, Users.Nick FROM OrgUsers "
+                                "JOIN Users ON Users.ID = OrgUsers.UserID "
+                                "WHERE OrgUsers.OrgID = ? AND OrgUsers.PermissionLevel = 0 AND OrgUsers.UserID > ? "
+                                "ORDER BY OrgUsers.UserID LIMIT ?", (org_id, after_user_id, limit)).fetchall()
+
+    def count_pending(self, org_id: int) -> int:
+        return self.con.execute("SELECT COUNT(*) FROM OrgUsers WHERE OrgID = ? AND PermissionLevel = 0",
+                                (org_id,)).fetchone()[0]
+
+    def approve_pending(self, org_id: int) -> list[tuple[int, str | None]]:
+        with self.transaction():
+            pending = self._all_pending(org_id)
+            self.con.executemany("UPDATE OrgUsers SET PermissionLevel = 1 WHERE OrgID = ? AND UserID = ?",
+                                 ((org_id, user_id) for user_id, _ in pending))
+            self._audit_many(("approved", user_id, org_id, 1, None) for user_id, _ in pending)
+            for user_id, _ in pending:
+                if user_id in self._users:
+                    self._users[user_id][1][org_id] = 1
+                self._invalidate_user(user_id)
+        return pending
+
+    def reject_pending(self, org_id: int) -> list[tuple[int, str | None]]:
+        with self.transaction():
+            pending = self._all_pending(org_id)
+            self.con.execute("DELETE FROM OrgUsers WHERE OrgID = ? AND PermissionLevel = 0", (org_id,))
+            self._audit_many(("rejected", user_id, org_id, 0, None) for user_id, _ in pending)
+            for user_id, _ in pending:
+                if user_id in self._users:
+                    self._users[user_id][1].pop(org_id, None)
+                self._invalidate_user(user_id)
+        return pending
+
+    def _all_pending(self, org_id: int) -> list[tuple[int, str | None]]:
+        pending = []
+        while page := self.get_pending(org_id, pending[-1][0] if pending else 0, _BATCH_SIZE):
+            pending.extend(page)
+        return pending
+
+    def get_history(self, user_id: int = None, org_id: int = None, before_id: int = None, limit: int = 20) \
+            -> list[tuple]:
+        conditions, parameters = ["ID < ?"], [before_id if before_id is not None else 2 ** 63 - 1]
+        if user_id is not None:
+            conditions.append("UserID = ?")
+            parameters.append(user_id)
+        if org_id is not None:
+            conditions.append("OrgID = ?")
+            parameters.append(org_id)
+        return self.con.execute(f"SELECT {_AUDIT_COLUMNS} FROM AuditLog WHERE {' AND '.join(conditions)} "
+                                "ORDER BY ID DESC LIMIT ?", (*parameters, limit)).fetchall()
+
+    # Deletes one batch per call, so that callers can let other queries for the guild run between batches
+    def compact_audit_log(self, retention_days: float, limit: int = _BATCH_SIZE * 10) -> int:
+        cutoff = int(time.time() - retention_days * 86400)
+        with self.transaction():
+            return self.con.execute("DELETE FROM AuditLog WHERE ID IN (SELECT ID FROM AuditLog WHERE Time < ? LIMIT ?)",
+                                    (cutoff, limit)).rowcount
+
+    def optimize(self):
+        self.con.execute("PRAGMA optimize")
+
+    def _org_levels(self, user_id: int) -> dict[int, int]:
+        if self._cache_loaded:
+            return dict(self._users.get(user_id, (None, {}))[1])
+        return dict(self.con.execute("SELECT OrgID, PermissionLevel FROM OrgUsers WHERE UserID = ?", (user_id,)))
+
+    def _audit(self, action: str, user_id: int = None, org_id: int = None, permission_level: int = None,
+               detail: str = None):
+        self._audit_many(((action, user_id, org_id, permission_level, detail),))
+
+    def _audit_many(self, entries: Iterable[tuple]):
+        now, actor_id = int(time.time()), audit_actor.get()
+        self.con.executemany("INSERT INTO AuditLog (Time, ActorID, Action, UserID, OrgID, PermissionLevel, Detail) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", ((now, actor_id, *entry) for entry in entries))
+
+
+def _membership_action(stored_level: int | None, permission_level: int) -> str:
+    if stored_level is None:
+        return "applied" if permission_level == 0 else "joined"
+    return "approved" if stored_level == 0 and permission_level > 0 else "permission_changed"
+
+
+def _removal_action(permission_level: int) -> str:
+    return "rejected" if permission_level == 0 else "left"
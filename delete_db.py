@@ -1,5 +1,8 @@
 import os
+import shutil
 
 if __name__ == "__main__":
     if "bot_db.sqlite" in os.listdir("./persistence"):
         os.remove("persistence/bot_db.sqlite")
+    if "guilds" in os.listdir("./persistence"):
+        shutil.rmtree("persistence/guilds")
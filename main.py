@@ -1,14 +1,25 @@
+import asyncio
+import hashlib
 import json
 import os
+import time
 from enum import Enum
-from typing import List
+from typing import List, Callable
 
 import discord
-from discord import Member, Role, Client, Intents, Interaction, Guild
+from discord import Member, Role, Client, AutoShardedClient, Intents, Interaction, Guild
 from discord.app_commands import CommandTree, describe, Transformer, Choice
 import discord.app_commands
 
+import async_database
+from action_queue import ActionQueue
+from notifications import JoinApplication, JoinApplicationNotifier, ApplicationStatus
 import database
+import metrics
+from permission_resolver import PermissionResolver
+from settings_service import SettingsService
+from reconciliation import Reconciler, RoleDrift
+import transfer
 
 
 def get_env_or_file(var_name: str) -> str:
@@ -35,56 +46,228 @@ default_permissions = discord.Permissions(
 )
 
 
-_MY_GUILD = discord.Object(id=int(get_env_or_file("GUILD")))
+# The first configured guild keeps the data of the original single guild deployment
+_GUILDS = [discord.Object(id=int(guild_id)) for guild_id in get_env_or_file("GUILD").split(",")]
+# Sharding is opt-in. SHARD_IDS lets several processes split the shards between them, and as every guild belongs to
+# exactly one shard, each per-guild database is only ever written by the process running that guild's shard
+_SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+_SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS").split(",")] if os.getenv("SHARD_IDS") else None
+if _SHARD_IDS is not None and not _SHARD_COUNT:
+    raise ValueError("SHARD_IDS requires SHARD_COUNT, the total number of shards across all processes")
+if _SHARD_IDS is not None and not all(0 <= shard_id < _SHARD_COUNT for shard_id in _SHARD_IDS):
+    raise ValueError(f"SHARD_IDS has to be between 0 and SHARD_COUNT - 1, got {_SHARD_IDS}")
+
+
+def shard_for(guild_id: int) -> int:
+    return (guild_id >> 22) % _SHARD_COUNT if _SHARD_COUNT else 0
+
+
+_SERVED_GUILDS = [guild for guild in _GUILDS if _SHARD_IDS is None or shard_for(guild.id) in _SHARD_IDS]
+# Events and interactions from any other guild the bot is in never get a database or worker thread
+database.serve_guilds(guild.id for guild in _SERVED_GUILDS)
+_MAX_CHOICES = 25
+_PENDING_PAGE_SIZE = 20
+# Seconds between incremental role reconciliation passes, 0 disables the periodic task
+_RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))
+# The periodic pass only reports drift unless roles or database mode is chosen explicitly
+_RECONCILE_MODE = os.getenv("RECONCILE_MODE", "report")
+# Audit log entries older than this are deleted once a day, 0 keeps the whole history
+_AUDIT_RETENTION_DAYS = float(os.getenv("AUDIT_RETENTION_DAYS", "365"))
+_HISTORY_PAGE_SIZE = 20
+_MAX_MESSAGE_LENGTH = 2000
+_MAX_IMPORT_BYTES = 8 * 2 ** 20
+
+
+_COMMAND_TREE_HASH_DIRECTORY = "persistence/command_trees"
+_startup_timer = time.perf_counter()
+startup_timings: dict[str, float] = {}
+
+
+def record_startup_phase(phase: str):
+    global _startup_timer
+    now = time.perf_counter()
+    startup_timings[phase] = now - _startup_timer
+    _startup_timer = now
 
 
 with open("phrases.json", "r", encoding="utf-8") as phrase_file:
     phrases = json.load(phrase_file)
+record_startup_phase("phrases")
+
 
+class _BotBehaviour:
+    tree: CommandTree
 
-class Bot(Client):
+    def dispatch(self, event: str, /, *args, **kwargs):
+        metrics.increment("bot_shard_events_total", str(_event_shard(args)))
+        super().dispatch(event, *args, **kwargs)
+
+    async def setup_hook(self):
+        if os.getenv("METRICS_PORT"):
+            await metrics.serve(os.getenv("METRICS_HOST", "127.0.0.1"), int(os.getenv("METRICS_PORT")))
+        record_startup_phase("login")
+        os.makedirs(_COMMAND_TREE_HASH_DIRECTORY, exist_ok=True)
+        for guild in _SERVED_GUILDS:
+            self.tree.copy_global_to(guild=guild)
+            tree_hash = hash_command_tree(self.tree, guild)
+            if tree_hash != read_command_tree_hash(guild):
+                await self.tree.sync(guild=guild)
+                with open(command_tree_hash_file(guild), "w", encoding="utf-8") as hash_file:
+                    hash_file.write(tree_hash)
+        record_startup_phase("command_sync")
+        if _RECONCILE_INTERVAL:
+            self.reconcile_task = asyncio.create_task(reconcile_periodically())
+        if _AUDIT_RETENTION_DAYS:
+            self.audit_compaction_task = asyncio.create_task(compact_audit_logs_periodically())
+
+    async def close(self):
+        await settings.flush()
+        await super().close()
+
+
+class BotCommandTree(metrics.InstrumentedCommandTree):
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        if not interaction.guild_id or not database.is_served(interaction.guild_id):
+            return False
+        database.audit_actor.set(interaction.user.id)
+        return await super().interaction_check(interaction)
+
+
+class Bot(_BotBehaviour, Client):
     def __init__(self, description: str, intents: Intents):
         super().__init__(description=description, intents=intents)
-        self.tree = CommandTree(self)
+        self.tree = BotCommandTree(self)
 
-    async def setup_hook(self):
-        self.tree.copy_global_to(guild=_MY_GUILD)
-        await self.tree.sync(guild=_MY_GUILD)
+
+class ShardedBot(_BotBehaviour, AutoShardedClient):
+    def __init__(self, description: str, intents: Intents, shard_count: int, shard_ids: list[int] | None):
+        super().__init__(description=description, intents=intents, shard_count=shard_count, shard_ids=shard_ids)
+        self.tree = BotCommandTree(self)
+
+
+def _event_shard(event_args: tuple) -> int | None:
+    for argument in event_args[:1]:
+        guild = argument if isinstance(argument, Guild) else getattr(argument, "guild", None)
+        if isinstance(guild, Guild):
+            return guild.shard_id
+    return None
+
+
+def hash_command_tree(tree: CommandTree, guild: discord.abc.Snowflake) -> str:
+    commands = sorted((command.to_dict() for command in tree.get_commands(guild=guild)),
+                      key=lambda command: command["name"])
+    payload = json.dumps({"guild": guild.id, "commands": commands}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def command_tree_hash_file(guild: discord.abc.Snowflake) -> str:
+    return os.path.join(_COMMAND_TREE_HASH_DIRECTORY, f"{guild.id}.sha256")
+
+
+def read_command_tree_hash(guild: discord.abc.Snowflake) -> str | None:
+    if not os.path.exists(command_tree_hash_file(guild)):
+        return None
+    with open(command_tree_hash_file(guild), "r", encoding="utf-8") as hash_file:
+        return hash_file.read().strip()
 
 
 def create_bot():
     description = phrases["bot_description"]
     intents = discord.Intents.default()
     intents.members = True
+    if _SHARD_COUNT:
+        return ShardedBot(description=description, intents=intents, shard_count=_SHARD_COUNT, shard_ids=_SHARD_IDS)
     return Bot(description=description, intents=intents)
 
 
+def render_application_digest(applications: list[JoinApplication]) -> str:
+    lines = [phrases["application_digest"].format(len(applications))]
+    for index, application in enumerate(applications):
+        if index == 0 or applications[index - 1].org_id != application.org_id:
+            lines.append(phrases["application_digest_org"].format(application.org_id))
+        entry = phrases["pending_entry"].format(application.user_id, application.nick)
+        if application.status != ApplicationStatus.pending:
+            entry = f"~~{entry}~~ {phrases['application_' + application.status.name]}"
+        lines.append(f"- {entry}")
+    lines.append(phrases["approval_instructions"].format("/", "approve", "/", "reject"))
+    return "\n".join(lines)
+
+
+def shard_latencies() -> dict[str, float]:
+    if isinstance(bot, AutoShardedClient):
+        return {str(shard_id): latency for shard_id, latency in bot.latencies}
+    return {"0": bot.latency}
+
+
 bot = create_bot()
+permission_resolver = PermissionResolver()
+action_queue = ActionQueue()
+application_notifier = JoinApplicationNotifier(action_queue, render_application_digest,
+                                               float(os.getenv("APPLICATION_DIGEST_SECONDS", "15")))
+reconciler = Reconciler(action_queue)
+database.connection_hooks.append(metrics.trace_sql)
+metrics.register_gauges("bot_database_cache", database.get_cache_stats)
+metrics.register_gauges("bot_action_queue", action_queue.metrics)
+metrics.register_gauges("bot_shard_latency_seconds", shard_latencies)
+
+settings = SettingsService(os.getenv("SETTINGS_PATH", "persistence/settings.json"))
+admin_channels: dict[int, discord.abc.GuildChannel] = {}
+
+
+def admin_channel(guild: Guild) -> discord.abc.GuildChannel | None:
+    if guild.id not in admin_channels:
+        channel = guild.get_channel(settings.admin_channel_id(guild.id))
+        if not channel:
+            return None
+        admin_channels[guild.id] = channel
+    return admin_channels[guild.id]
+
+
+def refresh_admin_channel(guild_id: int, key: str, _):
+    if key == "admin_channel_id":
+        admin_channels.pop(guild_id, None)
 
-if "settings.json" not in os.listdir("persistence"):
-    with open("persistence/settings.json", "w", encoding="utf-8") as new_settings:
-        new_settings.writelines(("{", "}"))
 
-with open("persistence/settings.json", "r", encoding="utf-8") as settings_file:
-    settings = json.load(settings_file)
+settings.subscribe(refresh_admin_channel)
 
 
 @bot.event
 async def on_member_join(member: Member):
-    database.add_user(member.id)
+    if database.is_served(member.guild.id):
+        await async_database.add_user(member.guild.id, member.id)
+
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    if admin_channels.get(channel.guild.id) is channel:
+        admin_channels.pop(channel.guild.id)
+
+
+@bot.event
+async def on_member_update(before: Member, after: Member):
+    if database.is_served(after.guild.id):
+        reconciler.on_member_update(before, after)
+
+
+@bot.event
+async def on_app_command_completion(interaction: Interaction, _: discord.app_commands.Command):
+    metrics.finish_interaction(interaction)
 
 
 @bot.event
 async def on_ready():
-    print("Connected")
+    for guild in filter(None, (bot.get_guild(configured_guild.id) for configured_guild in _SERVED_GUILDS)):
+        added = await async_database.add_users(guild.id, (member.id for member in guild.members))
+        print(f"Connected to {guild.name}, added {added} of {len(guild.members)} guild members to the database")
+    if "gateway_ready" not in startup_timings:
+        record_startup_phase("gateway_ready")
+        print("Startup timings: " + ", ".join(f"{phase} {seconds * 1000:.0f} ms"
+                                              for phase, seconds in startup_timings.items()))
 
 
 def is_bot_admin():
     async def predicate(interaction: Interaction):
-        if interaction.user.guild_permissions.administrator:
-            return True
-        user = database.get_user(interaction.user.id)
-        return 3 in [user_permissions.permission_level for user_permissions in user.orgs]
+        return (await permission_resolver.resolve(interaction.user)).max_level >= Permissions.admin.value
     return discord.app_commands.check(predicate)
 
 
@@ -98,81 +281,75 @@ def is_server_admin():
 
 def is_admin_channel():
     async def predicate(interaction: Interaction):
-        return "admin_channel_id" in settings and interaction.channel.id == settings["admin_channel_id"]
+        return interaction.channel.id == settings.admin_channel_id(interaction.guild_id)
     return discord.app_commands.check(predicate)
 
 
-def user_in_org(org_name: str, user: database.User, min_level: int = 0, max_level: int = 3):
-    for org in user.orgs:
-        if org.org.name == org_name:
-            return min_level <= org.permission_level <= max_level
-    return False
-
-
 class OrganisationBase(Transformer):
+    @metrics.timed_method("bot_transformer_seconds")
     async def transform(self, interaction: Interaction, value: str) -> database.Org:
-        org = database.get_org(value)
+        org = await async_database.get_org(interaction.guild_id, value)
         if not org:
             await interaction.response.send_message(phrases["no_org"].format(value), ephemeral=True)
             raise Exception()
         org.role = interaction.guild.get_role(org.org_id)
         return org
 
+    @metrics.timed_method("bot_transformer_seconds")
     async def autocomplete(self, interaction: Interaction, value: str) \
             -> List[Choice[str]]:
-        all_org_choices = [Choice(name=org, value=org) for org in database.get_org_names()]
-        choices = self._conditional_hook(interaction, all_org_choices)
-        return [choice for choice in choices if self._text_matches(value, choice.name)]
-
-    @staticmethod
-    def _text_matches(value: str, org_name: str):
-        return (value.lower() in org_name.lower()) or not value
+        try:
+            accept = await self._conditional_hook(interaction)
+            org_names = await async_database.search_org_names(interaction.guild_id, value, accept, _MAX_CHOICES)
+            return [Choice(name=org, value=org) for org in org_names]
+        finally:
+            metrics.finish_interaction(interaction)
 
-    def _conditional_hook(self, interaction: Interaction, orgs: list[Choice[str]]) \
-            -> list[Choice[str]]:
-        pass
+    async def _conditional_hook(self, interaction: Interaction) -> Callable[[database.Org], bool]:
+        return lambda org: True
 
 
 class JoinableOrganisation(OrganisationBase):
-    def _conditional_hook(self, interaction: Interaction, orgs: list[Choice[str]]) \
-            -> list[Choice[str]]:
-        user = database.get_user(interaction.user.id)
-        return [org for org in orgs if not user_in_org(org.value, user)]
+    async def _conditional_hook(self, interaction: Interaction) -> Callable[[database.Org], bool]:
+        memberships = await async_database.get_memberships(interaction.guild_id, interaction.user.id)
+        return lambda org: org.org_id not in memberships.orgs
 
 
 class AddableOrganisation(OrganisationBase):
-    def _conditional_hook(self, interaction: Interaction, orgs: list[Choice[str]]) \
-            -> list[Choice[str]]:
-        user = database.get_user(interaction.namespace.member.id)
-        return [org for org in orgs if not user_in_org(org.value, user)]
+    async def _conditional_hook(self, interaction: Interaction) -> Callable[[database.Org], bool]:
+        memberships = await async_database.get_memberships(interaction.guild_id, interaction.namespace.member.id)
+        return lambda org: org.org_id not in memberships.orgs
 
 
 class LeavableOrganisation(OrganisationBase):
-    def _conditional_hook(self, interaction: Interaction, orgs: list[Choice[str]]) \
-            -> list[Choice[str]]:
-        user = database.get_user(interaction.user.id)
-        return [org for org in orgs if user_in_org(org.value, user, 1)]
+    async def _conditional_hook(self, interaction: Interaction) -> Callable[[database.Org], bool]:
+        memberships = await async_database.get_memberships(interaction.guild_id, interaction.user.id)
+        return lambda org: org.org_id in memberships.members
 
 
 class RemovableOrganisation(OrganisationBase):
-    def _conditional_hook(self, interaction: Interaction, orgs: list[Choice[str]]) \
-            -> list[Choice[str]]:
-        user = database.get_user(interaction.namespace.member.id)
-        return [org for org in orgs if user_in_org(org.value, user, 1)]
+    async def _conditional_hook(self, interaction: Interaction) -> Callable[[database.Org], bool]:
+        memberships = await async_database.get_memberships(interaction.guild_id, interaction.namespace.member.id)
+        return lambda org: org.org_id in memberships.members
 
 
 class ApprovableOrganisation(OrganisationBase):
-    def _conditional_hook(self, interaction: Interaction, orgs: list[Choice[str]]) \
-            -> list[Choice[str]]:
-        user = database.get_user(interaction.namespace.member.id)
-        return [org for org in orgs if user_in_org(org.value, user, max_level=0)]
+    async def _conditional_hook(self, interaction: Interaction) -> Callable[[database.Org], bool]:
+        memberships = await async_database.get_memberships(interaction.guild_id, interaction.namespace.member.id)
+        return lambda org: org.org_id in memberships.pending
+
+
+class ModeratedOrganisation(OrganisationBase):
+    async def _conditional_hook(self, interaction: Interaction) -> Callable[[database.Org], bool]:
+        author_permissions = await permission_resolver.resolve(interaction.user)
+        return lambda org: author_permissions.level(org.org_id) >= Permissions.moderator.value
 
 
 @bot.tree.command(name="add-org", description=phrases["add_org"])
 @describe(org_name=phrases["org_name"])
 @is_bot_admin()
 async def add_org(interaction: Interaction, *, org_name: str):
-    if database.org_exists(org_name):
+    if await async_database.org_exists(interaction.guild_id, org_name):
         return await interaction.response.send_message(phrases["org_exists"].format(org_name), ephemeral=True)
     common_category = await try_create_category(interaction, phrases["common"])
     org_category = await try_create_category(interaction, org_name)
@@ -180,7 +357,7 @@ async def add_org(interaction: Interaction, *, org_name: str):
     if not org_role:
         org_role = await interaction.guild.create_role(name=org_name, permissions=default_permissions)
     await add_role_permissions(org_role, common_category, org_category)
-    database.add_org(database.Org(org_role.id, org_name))
+    await async_database.add_org(interaction.guild_id, database.Org(org_role.id, org_name))
     await interaction.response.send_message(phrases["org_added"].format(org_role.id), ephemeral=True)
 
 
@@ -199,70 +376,152 @@ async def add_role_permissions(org_role: discord.Role, *categories: discord.Cate
         await category.edit(overwrites=overwrites)
 
 
-def ensure_author_permissions(author: Member, to_approve: database.User) -> bool:
-    if author.guild_permissions.administrator:
-        return True
-    author_permissions = database.get_user(author.id).orgs
-    wanted_org = to_approve.orgs[0].org
-    author_org_permissions = next((org for org in author_permissions if org.org.org_id == wanted_org.org_id), None)
-    if not author_permissions or author_org_permissions.permission_level < 2:
-        return False
-    return True
+async def ensure_author_permissions(author: Member, org: database.Org) -> bool:
+    author_permissions = await permission_resolver.resolve(author)
+    return author_permissions.level(org.org_id) >= Permissions.moderator.value
 
 
 @bot.tree.command(description=phrases["approve"])
 @describe(member=phrases["approved_member"])
 async def approve(interaction: Interaction, member: Member,
                   org: discord.app_commands.Transform[database.Org, ApprovableOrganisation]):
-    user, org = await ensure_user_waiting_approval(interaction, member, org)
+    user, application = await ensure_user_waiting_approval(interaction, member, org)
     if not user:
         return
-    if not ensure_author_permissions(interaction.user, user):
-        message = phrases["invalid_approval_permissions"].format(user.user_id, user.orgs[0].org.org_id,
-                                                                 interaction.user.id)
+    org = application.org
+    if not await ensure_author_permissions(interaction.user, org):
+        message = phrases["invalid_approval_permissions"].format(user.user_id, org.org_id, interaction.user.id)
         return await interaction.response.send_message(message, ephemeral=True)
-    user.orgs[0].permission_level = 1
-    database.update_user(user)
-    await member.edit(nick=user.nick)
-    await member.add_roles(interaction.guild.get_role(org.org_id))
+    role = await ensure_org_role(interaction, org)
+    if not role:
+        return
+    application.permission_level = 1
+    await async_database.update_user(interaction.guild_id, user)
     await interaction.response.send_message(phrases["user_approved"].format(user.user_id, org.org_id),
                                             ephemeral=True)
-    await member.send(phrases["approved_dm"].format(interaction.guild.name, org.name))
+    action_queue.edit_member(member, nick=user.nick, add_roles=(role,))
+    action_queue.send(member, phrases["approved_dm"].format(interaction.guild.name, org.name))
+    application_notifier.resolve(interaction.guild_id, user.user_id, org.org_id, approved=True)
 
 
 @bot.tree.command(description=phrases["reject"])
 @describe(member=phrases["rejected_member"])
 async def reject(interaction: Interaction, member: Member,
                  org: discord.app_commands.Transform[database.Org, ApprovableOrganisation]):
-    user, org = await ensure_user_waiting_approval(interaction, member, org)
+    user, application = await ensure_user_waiting_approval(interaction, member, org)
     if not user:
         return
-    if not ensure_author_permissions(interaction.user, user):
+    org = application.org
+    if not await ensure_author_permissions(interaction.user, org):
         message = phrases["invalid_reject_permissions"].format(user.user_id, org.org_id, interaction.user.id)
         return await interaction.response.send_message(message, ephemeral=True)
-    database.delete_user(user)
+    # Only the rejected application is removed, the user's other memberships and nick are kept
+    await async_database.delete_user_org(interaction.guild_id, application, user.user_id)
     message = phrases["user_rejected"].format(user.user_id, org.org_id)
     await interaction.response.send_message(message, ephemeral=True)
-    await member.send(phrases["rejected_dm"].format(interaction.guild.name, org.name))
+    action_queue.send(member, phrases["rejected_dm"].format(interaction.guild.name, org.name))
+    application_notifier.resolve(interaction.guild_id, user.user_id, org.org_id, approved=False)
 
 
 async def ensure_user_waiting_approval(interaction: Interaction, member: Member, org: database.Org) \
-        -> (database.User, database.Org):
-    user = database.get_user(member.id)
-    approvable_orgs: {int, database.OrgPermissions} = {org.org.org_id: org for org in user.orgs}
+        -> (database.User | None, database.OrgPermissions | None):
+    user = await async_database.get_user(interaction.guild_id, member.id)
+    approvable_orgs: {int, database.OrgPermissions} = {user_org.org.org_id: user_org for user_org in user.orgs}
     if org.org_id not in approvable_orgs:
         await interaction.response.send_message(phrases["need_org_to_approve"], ephemeral=True)
     elif approvable_orgs[org.org_id].permission_level > 0:
-        message = phrases["already_registered"].format(member.user_id, org.org_id)
+        message = phrases["already_registered"].format(member.id, org.org_id)
         await interaction.response.send_message(message, ephemeral=True)
     else:
-        return user, approvable_orgs[org.org_id].org
+        return user, approvable_orgs[org.org_id]
+    return None, None
+
+
+async def ensure_org_role(interaction: Interaction, org: database.Org) -> Role | None:
+    role = interaction.guild.get_role(org.org_id)
+    if not role:
+        await interaction.response.send_message(phrases["org_role_missing"].format(org.name), ephemeral=True)
+    return role
+
+
+async def ensure_moderator(interaction: Interaction, org: database.Org) -> bool:
+    author_permissions = await permission_resolver.resolve(interaction.user)
+    if author_permissions.level(org.org_id) >= Permissions.moderator.value:
+        return True
+    message = phrases["invalid_moderation_permissions"].format(org.org_id)
+    await interaction.response.send_message(message, ephemeral=True)
+    return False
+
+
+class PendingView(discord.ui.View):
+    def __init__(self, org: database.Org, after_user_id: int):
+        super().__init__()
+        self._org = org
+        self._after_user_id = after_user_id
+
+    @discord.ui.button(label=phrases["next_page"])
+    async def next_page(self, interaction: Interaction, _: discord.ui.Button):
+        await send_pending_page(interaction, self._org, self._after_user_id)
+
+
+async def send_pending_page(interaction: Interaction, org: database.Org, after_user_id: int = 0):
+    pending_users = await async_database.get_pending(interaction.guild_id, org.org_id, after_user_id,
+                                                     _PENDING_PAGE_SIZE + 1)
+    if not pending_users:
+        return await interaction.response.send_message(phrases["no_pending"].format(org.org_id), ephemeral=True)
+    page = pending_users[:_PENDING_PAGE_SIZE]
+    pending_count = await async_database.count_pending(interaction.guild_id, org.org_id)
+    lines = [phrases["pending_header"].format(org.org_id, pending_count)]
+    lines.extend(phrases["pending_entry"].format(user_id, nick) for user_id, nick in page)
+    view = PendingView(org, page[-1][0]) if len(pending_users) > _PENDING_PAGE_SIZE else discord.utils.MISSING
+    await interaction.response.send_message("\n".join(lines), view=view, ephemeral=True)
+
+
+@bot.tree.command(description=phrases["pending"])
+@describe(org=phrases["pending_org"])
+async def pending(interaction: Interaction,
+                  org: discord.app_commands.Transform[database.Org, ModeratedOrganisation]):
+    if await ensure_moderator(interaction, org):
+        await send_pending_page(interaction, org)
+
+
+@bot.tree.command(name="approve-all", description=phrases["approve_all"])
+@describe(org=phrases["bulk_org"])
+async def approve_all(interaction: Interaction,
+                      org: discord.app_commands.Transform[database.Org, ModeratedOrganisation]):
+    if not await ensure_moderator(interaction, org) or not await ensure_org_role(interaction, org):
+        return
+    approved = await async_database.approve_pending(interaction.guild_id, org.org_id)
+    await interaction.response.send_message(phrases["all_approved"].format(len(approved), org.org_id),
+                                            ephemeral=True)
+    for user_id, nick in approved:
+        application_notifier.resolve(interaction.guild_id, user_id, org.org_id, approved=True)
+        member = interaction.guild.get_member(user_id)
+        if member:
+            action_queue.edit_member(member, nick=nick, add_roles=(org.role,))
+            action_queue.send(member, phrases["approved_dm"].format(interaction.guild.name, org.name))
+
+
+@bot.tree.command(name="reject-all", description=phrases["reject_all"])
+@describe(org=phrases["bulk_org"])
+async def reject_all(interaction: Interaction,
+                     org: discord.app_commands.Transform[database.Org, ModeratedOrganisation]):
+    if not await ensure_moderator(interaction, org):
+        return
+    rejected = await async_database.reject_pending(interaction.guild_id, org.org_id)
+    await interaction.response.send_message(phrases["all_rejected"].format(len(rejected), org.org_id),
+                                            ephemeral=True)
+    for user_id, _ in rejected:
+        application_notifier.resolve(interaction.guild_id, user_id, org.org_id, approved=False)
+        member = interaction.guild.get_member(user_id)
+        if member:
+            action_queue.send(member, phrases["rejected_dm"].format(interaction.guild.name, org.name))
 
 
 @bot.tree.command(description=phrases["join"])
 async def join(interaction: Interaction, org: discord.app_commands.Transform[database.Org, JoinableOrganisation]):
     member = interaction.guild.get_member(interaction.user.id)
-    user = database.get_user(member.id)
+    user = await async_database.get_user(interaction.guild_id, member.id)
     if not (user.nick and interaction.guild.get_member(user.user_id).nick):
         await interaction.response.send_modal(GiveNameModal(org))
     else:
@@ -279,6 +538,7 @@ class GiveNameModal(discord.ui.Modal, title=phrases["give_name_modal_title"]):
                                 placeholder=phrases["join_modal_name_placeholder"])
 
     async def on_submit(self, interaction: Interaction):
+        database.audit_actor.set(interaction.user.id)
         await send_join_application(interaction, self._org, self.name.value)
 
     async def on_error(self, interaction: Interaction, error: Exception):
@@ -286,17 +546,15 @@ class GiveNameModal(discord.ui.Modal, title=phrases["give_name_modal_title"]):
 
 
 async def send_join_application(interaction: Interaction, org: database.Org, name: str):
-    user = database.get_user(interaction.user.id)
-    admin_channel = bot.get_channel(settings["admin_channel_id"])
+    user = await async_database.get_user(interaction.guild_id, interaction.user.id)
     user.orgs.append(database.OrgPermissions(org))
     if name != user.nick:
         user.nick = name
-    register_info = phrases["pending_registration"].format(user.user_id, user.nick, org.org_id)
-    approval_instructions = phrases["approval_instructions"].format("/", "approve", "/", "reject")
-    database.update_user(user)
-    await admin_channel.send(f"{register_info} {approval_instructions}")
+    await async_database.update_user(interaction.guild_id, user)
     message = phrases["awaiting_approval"].format(org.name, name)
     await interaction.response.send_message(message, ephemeral=True)
+    if admin_channel(interaction.guild):
+        application_notifier.add(admin_channel(interaction.guild), user.user_id, user.nick, org.org_id)
 
 
 @bot.tree.command(name="add-to-org", description=phrases["add"])
@@ -304,17 +562,19 @@ async def send_join_application(interaction: Interaction, org: database.Org, nam
 @is_bot_admin()
 async def add_to_org(interaction: Interaction, member: Member,
                      org: discord.app_commands.Transform[database.Org, AddableOrganisation]):
-    user = database.get_user(member.id)
-    role: Role = org.role
+    role = await ensure_org_role(interaction, org)
+    if not role:
+        return
+    user = await async_database.get_user(interaction.guild_id, member.id)
     if role.id in [user_org.org.org_id for user_org in user.orgs]:
-        return await interaction.response.send_message(phrases["already_registered"].format(member.user_id, role.id),
+        return await interaction.response.send_message(phrases["already_registered"].format(member.id, role.id),
                                                        ephemeral=True)
-    user_org = database.OrgPermissions(database.get_org(role.id), 1)
+    user_org = database.OrgPermissions(await async_database.get_org(interaction.guild_id, role.id), 1)
     user.orgs.append(user_org)
-    database.update_user(user)
-    await member.add_roles(interaction.guild.get_role(role.id))
+    await async_database.update_user(interaction.guild_id, user)
     await interaction.response.send_message(phrases["org_joined"].format(user.user_id, org.org_id),
                                             ephemeral=True)
+    action_queue.edit_member(member, add_roles=(role,))
 
 
 @bot.tree.command(name="remove-from-org", description=phrases["leave"])
@@ -322,15 +582,16 @@ async def add_to_org(interaction: Interaction, member: Member,
 @is_bot_admin()
 async def remove_from_org(interaction: Interaction, member: Member,
                           org: discord.app_commands.Transform[database.Org, RemovableOrganisation]):
-    user = database.get_user(member.id)
-    role: Role = org.role
-    deleted_org = next((user_org for user_org in user.orgs), None)
+    user = await async_database.get_user(interaction.guild_id, member.id)
+    deleted_org = next((user_org for user_org in user.orgs if user_org.org.org_id == org.org_id), None)
     if not deleted_org:
-        return await interaction.response.send_message(phrases["not_org_member"].format(member.id, role.id),
+        return await interaction.response.send_message(phrases["not_org_member"].format(member.id, org.org_id),
                                                        ephemeral=True)
-    database.delete_user_org(deleted_org, user.user_id)
-    await member.remove_roles(role)
-    await interaction.response.send_message(phrases["org_left"].format(user.user_id, role.id), ephemeral=True)
+    await async_database.delete_user_org(interaction.guild_id, deleted_org, user.user_id)
+    await interaction.response.send_message(phrases["org_left"].format(user.user_id, org.org_id), ephemeral=True)
+    # The membership row is removed even when the org's role has been deleted from Discord
+    if org.role:
+        action_queue.edit_member(member, remove_roles=(org.role,))
 
 
 class RegisterCommands(Enum):
@@ -341,24 +602,171 @@ class RegisterCommands(Enum):
 @bot.tree.command(name="register-admin-channel", description=phrases["register"])
 @is_server_admin()
 async def register_admin_channel(interaction: Interaction):
-    settings["admin_channel_id"] = interaction.channel.id
-    with open("persistence/settings.json", "w", encoding="utf-8") as settings_out:
-        json.dump(settings, settings_out)
+    settings.set_admin_channel_id(interaction.guild_id, interaction.channel.id)
     await interaction.response.send_message(phrases["admin_channel_registered"].format(interaction.channel.id),
                                             ephemeral=True)
 
 
+class ReconcileMode(Enum):
+    report = 0
+    roles = 1
+    database = 2
+
+
+async def apply_reconciliation(guild: Guild, drift: RoleDrift, mode: ReconcileMode):
+    if mode == ReconcileMode.roles:
+        reconciler.apply_to_roles(guild, drift)
+    elif mode == ReconcileMode.database:
+        await reconciler.apply_to_database(guild, drift)
+
+
+async def reconcile_periodically():
+    mode = ReconcileMode[_RECONCILE_MODE]
+    await bot.wait_until_ready()
+    while not bot.is_closed():
+        for guild in filter(None, (bot.get_guild(configured_guild.id) for configured_guild in _SERVED_GUILDS)):
+            try:
+                drift = await reconciler.diff(guild)
+                if drift:
+                    await apply_reconciliation(guild, drift, mode)
+                    print(f"Reconciled {guild.name} ({mode.name}): {drift}")
+            except Exception as error:
+                print(f"Role reconciliation failed for {guild.name}: {error!r}")
+        await asyncio.sleep(_RECONCILE_INTERVAL)
+
+
+@bot.tree.command(description=phrases["reconcile"])
+@describe(mode=phrases["reconcile_mode"])
+@is_bot_admin()
+async def reconcile(interaction: Interaction, mode: ReconcileMode):
+    drift = await reconciler.diff(interaction.guild, full=True)
+    await apply_reconciliation(interaction.guild, drift, mode)
+    message = phrases["reconcile_report"].format(mode.name, drift.missing_count, drift.extra_count,
+                                                 drift.protected_count)
+    await interaction.response.send_message(message, ephemeral=True)
+
+
+async def compact_audit_logs_periodically():
+    await bot.wait_until_ready()
+    while not bot.is_closed():
+        for configured_guild in _SERVED_GUILDS:
+            deleted = 0
+            # One batch per call, so that interactions queued on the guild's worker run between batches
+            while removed := await async_database.compact_audit_log(configured_guild.id, _AUDIT_RETENTION_DAYS):
+                deleted += removed
+            if deleted:
+                await async_database.optimize(configured_guild.id)
+                print(f"Deleted {deleted} audit log entries older than {_AUDIT_RETENTION_DAYS} days "
+                      f"from guild {configured_guild.id}")
+        await asyncio.sleep(24 * 60 * 60)
+
+
+def format_audit_entry(entry: tuple) -> str:
+    _, timestamp, actor_id, action, user_id, org_id, permission_level, detail = entry
+    description = phrases[f"audit_{action}"].format(user=user_id, org=org_id, level=permission_level, detail=detail)
+    actor = f"<@{actor_id}>" if actor_id else phrases["audit_system"]
+    return phrases["history_entry"].format(timestamp, actor, description)
+
+
+class HistoryView(discord.ui.View):
+    def __init__(self, user_id: int | None, org_id: int | None, before_id: int):
+        super().__init__()
+        self._user_id = user_id
+        self._org_id = org_id
+        self._before_id = before_id
+
+    @discord.ui.button(label=phrases["next_page"])
+    async def next_page(self, interaction: Interaction, _: discord.ui.Button):
+        await send_history_page(interaction, self._user_id, self._org_id, self._before_id)
+
+
+async def send_history_page(interaction: Interaction, user_id: int | None, org_id: int | None,
+                            before_id: int = None):
+    entries = await async_database.get_history(interaction.guild_id, user_id, org_id, before_id,
+                                               _HISTORY_PAGE_SIZE + 1)
+    if not entries:
+        return await interaction.response.send_message(phrases["no_history"], ephemeral=True)
+    content, shown = render_history_page(entries[:_HISTORY_PAGE_SIZE])
+    view = HistoryView(user_id, org_id, entries[shown - 1][0]) if len(entries) > shown else discord.utils.MISSING
+    await interaction.response.send_message(content, view=view, ephemeral=True)
+
+
+def render_history_page(entries: list[tuple]) -> tuple[str, int]:
+    # Snowflake mentions make entries long, so a page ends early rather than going over the message limit
+    content = phrases["history_header"]
+    for shown, entry in enumerate(entries):
+        line = format_audit_entry(entry)
+        if shown and len(content) + 1 + len(line) > _MAX_MESSAGE_LENGTH:
+            return content, shown
+        content += "\n" + line
+    return content, len(entries)
+
+
+@bot.tree.command(description=phrases["history"])
+@describe(member=phrases["history_member"], org=phrases["history_org"])
+@is_bot_admin()
+async def history(interaction: Interaction, member: Member = None,
+                  org: discord.app_commands.Transform[database.Org, OrganisationBase] = None):
+    await send_history_page(interaction, member.id if member else None, org.org_id if org else None)
+
+
+class TransferFormat(Enum):
+    jsonl = 0
+    csv = 1
+
+
+@bot.tree.command(description=phrases["export"])
+@describe(file_format=phrases["transfer_format"])
+@is_bot_admin()
+async def export(interaction: Interaction, file_format: TransferFormat):
+    await interaction.response.defer(ephemeral=True)
+    export_file = await async_database.run_in_transaction(interaction.guild_id, transfer.export_to_file,
+                                                          file_format.name)
+    with export_file:
+        await interaction.followup.send(phrases["exported"], ephemeral=True,
+                                        file=discord.File(export_file, f"{interaction.guild_id}.{file_format.name}"))
+
+
+@bot.tree.command(name="import", description=phrases["import"])
+@describe(attachment=phrases["import_file"], dry_run=phrases["import_dry_run"])
+@is_bot_admin()
+async def import_file(interaction: Interaction, attachment: discord.Attachment, dry_run: bool = True):
+    if attachment.size > _MAX_IMPORT_BYTES:
+        return await interaction.response.send_message(
+            phrases["import_too_large"].format(_MAX_IMPORT_BYTES // 2 ** 20), ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+    try:
+        lines = (await attachment.read()).decode("utf-8").splitlines(keepends=True)
+    except UnicodeDecodeError:
+        return await interaction.followup.send(phrases["import_not_utf8"], ephemeral=True)
+    role_ids = {role.id for role in interaction.guild.roles}
+    try:
+        diff = await async_database.run_in_transaction(interaction.guild_id, transfer.import_lines, lines,
+                                                       transfer.detect_format(attachment.filename), dry_run, role_ids)
+        result_phrase = "import_dry_run_result" if dry_run else "import_result"
+    except database.ImportRejected as rejected:
+        diff, result_phrase = rejected.diff, "import_rejected"
+    await interaction.followup.send(phrases[result_phrase].format(diff.summary()), ephemeral=True)
+    if result_phrase == "import_result":
+        for org_id, name in diff.renamed_orgs.items():
+            role = interaction.guild.get_role(org_id)
+            if role and role.name != name:
+                action_queue.rename_role(role, name)
+
+
 class Permissions(Enum):
     admin = 3
     moderator = 2
     user = 1
 
 
-async def set_channel_permissions(guild: Guild, member: Member, permission_level: int):
-    admin_channel = guild.get_channel(settings["admin_channel_id"])
+def set_channel_permissions(guild: Guild, member: Member, permission_level: int):
+    if not admin_channel(guild):
+        return
     if permission_level < 2:
-        return await admin_channel.set_permissions(member, overwrite=None)
-    await admin_channel.set_permissions(member, read_messages=True, send_messages=True)
+        return action_queue.set_permissions(admin_channel(guild), member, None)
+    action_queue.set_permissions(admin_channel(guild), member,
+                                 discord.PermissionOverwrite(read_messages=True, send_messages=True))
 
 
 @bot.tree.command(description=phrases["permissions"])
@@ -371,7 +779,7 @@ async def permissions(interaction: Interaction, member: Member,
     permission = permission_level.value
     if not org:
         return await interaction.response.send_message(phrases["role_is_not_org"].format(org.role.name), ephemeral=True)
-    user = database.get_user(member.id)
+    user = await async_database.get_user(interaction.guild_id, member.id)
     user_org = next((org_permissions for org_permissions in user.orgs if org_permissions.org.org_id == org.org_id),
                     None)
     if not user_org:
@@ -379,13 +787,19 @@ async def permissions(interaction: Interaction, member: Member,
         return await interaction.response.send_message(message, ephemeral=True)
     user_org.permission_level = permission_level.value
     max_permissions = max(permission, *[org_permissions.permission_level for org_permissions in user.orgs])
-    await set_channel_permissions(interaction.guild, member, max_permissions)
-    database.update_user(user)
+    await async_database.update_user(interaction.guild_id, user)
     message = phrases["permissions_updated"].format(member.id, org.org_id, permission_level.name)
     await interaction.response.send_message(message, ephemeral=True)
+    set_channel_permissions(interaction.guild, member, max_permissions)
 
 
 if __name__ == '__main__':
-    database.init_databases()
+    # Only the process serving the first guild adopts the single guild deployment's database and settings
+    if _GUILDS[0] in _SERVED_GUILDS:
+        database.migrate_legacy_database(_GUILDS[0].id)
+        settings.adopt_legacy_settings(_GUILDS[0].id)
+    for configured_guild in _SERVED_GUILDS:
+        database.for_guild(configured_guild.id)
+    record_startup_phase("database")
     token = get_env_or_file("TOKEN")
-    bot.run(token)
+    bot.run(token, root_logger=True)
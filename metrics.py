@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable
+
+from discord import Interaction, InteractionType
+from discord.app_commands import AppCommandError, CommandTree
+
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_SLOW_INTERACTION_SECONDS = float(os.getenv("SLOW_INTERACTION_MS", "500")) / 1000
+
+_logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        for index, upper_bound in enumerate(_BUCKETS):
+            if seconds <= upper_bound:
+                self.bucket_counts[index] += 1
+                break
+
+
+class InteractionTrace:
+    def __init__(self, name: str):
+        self.name = name
+        self.statements: list[str] = []
+        self.database_seconds = 0.0
+        self.started = time.perf_counter()
+
+
+_histograms: dict[str, dict[str, Histogram]] = {}
+_counters: dict[str, dict[str, float]] = {}
+_gauges: dict[str, Callable[[], dict[str, float]]] = {}
+_current_trace: ContextVar[InteractionTrace | None] = ContextVar("current_trace", default=None)
+# Database worker threads record metrics while the event loop renders them
+_lock = threading.Lock()
+
+
+def observe(metric: str, label: str, seconds: float):
+    with _lock:
+        _histograms.setdefault(metric, {}).setdefault(label, Histogram()).observe(seconds)
+
+
+def increment(metric: str, label: str, amount: float = 1):
+    with _lock:
+        labels = _counters.setdefault(metric, {})
+        labels[label] = labels.get(label, 0) + amount
+
+
+def total(metric: str) -> float:
+    with _lock:
+        return sum(_counters.get(metric, {}).values())
+
+
+def register_gauges(metric: str, collect: Callable[[], dict[str, float]]):
+    _gauges[metric] = collect
+
+
+def record_database_call(function_name: str, seconds: float):
+    observe("bot_database_call_seconds", function_name, seconds)
+    trace = _current_trace.get()
+    if trace:
+        trace.database_seconds += seconds
+
+
+def trace_sql(connection: sqlite3.Connection):
+    connection.set_trace_callback(_trace_statement)
+
+
+def _trace_statement(statement: str):
+    increment("bot_sql_statements_total", statement.lstrip().split(" ", 1)[0].upper())
+    trace = _current_trace.get()
+    if trace:
+        trace.statements.append(statement)
+
+
+def timed_method(metric: str):
+    def decorator(method):
+        @wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                observe(metric, f"{type(self).__name__}.{method.__name__}", time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def start_interaction(interaction: Interaction):
+    kind = "autocomplete" if interaction.type is InteractionType.autocomplete else "command"
+    trace = InteractionTrace(f"{kind} {interaction.data.get('name', 'unknown')}")
+    interaction.extras["trace"] = trace
+    # The rest of the interaction runs in the same task, so its database calls and statements land in this trace
+    _current_trace.set(trace)
+
+
+def finish_interaction(interaction: Interaction):
+    trace = interaction.extras.pop("trace", None)
+    if trace is None:
+        return
+    elapsed = time.perf_counter() - trace.started
+    kind, name = trace.name.split(" ", 1)
+    observe(f"bot_{kind}_seconds", name, elapsed)
+    if elapsed >= _SLOW_INTERACTION_SECONDS:
+        _log_slow_interaction(trace, elapsed)
+
+
+# Successful commands are finished by the client's app_command_completion event and autocompletes by their
+# callback, see finish_interaction
+class InstrumentedCommandTree(CommandTree):
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        start_interaction(interaction)
+        return True
+
+    async def on_error(self, interaction: Interaction, error: AppCommandError):
+        finish_interaction(interaction)
+        await super().on_error(interaction, error)
+
+
+def _log_slow_interaction(trace: InteractionTrace, elapsed: float):
+    _logger.warning("Slow interaction '%s': %.1f ms, %d SQL statements, %.1f ms in the database%s", trace.name,
+                    elapsed * 1000, len(trace.statements), trace.database_seconds * 1000,
+                    "".join(f"\n    {statement}" for statement in trace.statements))
+
+
+def render() -> str:
+    with _lock:
+        histograms = {metric: [(label, list(histogram.bucket_counts), histogram.count, histogram.sum)
+                               for label, histogram in labels.items()] for metric, labels in _histograms.items()}
+        counters = {metric: list(labels.items()) for metric, labels in _counters.items()}
+    lines = []
+    for metric, labels in histograms.items():
+        lines.append(f"# TYPE {metric} histogram")
+        for label, bucket_counts, count, seconds in labels:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(_BUCKETS, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{name="{label}",le="{upper_bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{name="{label}",le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{name="{label}"}} {seconds}')
+            lines.append(f'{metric}_count{{name="{label}"}} {count}')
+    for metric, labels in counters.items():
+        lines.append(f"# TYPE {metric} counter")
+        lines.extend(f'{metric}{{name="{label}"}} {value}' for label, value in labels)
+    for metric, collect in list(_gauges.items()):
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(f'{metric}{{name="{label}"}} {value}' for label, value in collect().items())
+    return "\n".join(lines) + "\n"
+
+
+async def serve(host: str, port: int) -> asyncio.AbstractServer:
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        body = render().encode("utf-8")
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+        await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,113 @@
+import asyncio
+from enum import Enum
+from typing import Callable
+
+import discord
+from discord.abc import GuildChannel
+
+from action_queue import ActionQueue
+
+_MAX_APPLICATIONS_PER_DIGEST = 20
+_MAX_MESSAGE_LENGTH = 2000
+
+
+class ApplicationStatus(Enum):
+    pending = 0
+    approved = 1
+    rejected = 2
+
+
+class JoinApplication:
+    def __init__(self, user_id: int, nick: str, org_id: int):
+        self.user_id = user_id
+        self.nick = nick
+        self.org_id = org_id
+        self.status = ApplicationStatus.pending
+
+    def __repr__(self):
+        return f"JoinApplication {self.user_id} to {self.org_id}, {self.status.name}"
+
+
+class _Digest:
+    def __init__(self, channel: GuildChannel, applications: list[JoinApplication]):
+        self.channel = channel
+        self.applications = applications
+        self.message_id: int | None = None
+        self.rendered = ""
+
+
+class JoinApplicationNotifier:
+    def __init__(self, action_queue: ActionQueue, render: Callable[[list[JoinApplication]], str],
+                 window: float = 15.0):
+        self._action_queue = action_queue
+        self._render = render
+        self._window = window
+        self._buffers: dict[int, list[JoinApplication]] = {}
+        self._flushes: dict[int, asyncio.Task] = {}
+        self._applications: dict[tuple[int, int, int], tuple[JoinApplication, _Digest | None]] = {}
+
+    def add(self, channel: GuildChannel, user_id: int, nick: str, org_id: int):
+        application = JoinApplication(user_id, nick, org_id)
+        self._applications[(channel.guild.id, user_id, org_id)] = (application, None)
+        self._buffers.setdefault(channel.id, []).append(application)
+        if channel.id not in self._flushes:
+            self._flushes[channel.id] = asyncio.create_task(self._flush_later(channel))
+
+    def resolve(self, guild_id: int, user_id: int, org_id: int, approved: bool):
+        application, digest = self._applications.get((guild_id, user_id, org_id), (None, None))
+        if not application:
+            return
+        application.status = ApplicationStatus.approved if approved else ApplicationStatus.rejected
+        if digest:
+            self._refresh(digest)
+
+    async def _flush_later(self, channel: GuildChannel):
+        await asyncio.sleep(self._window)
+        del self._flushes[channel.id]
+        applications = sorted(self._buffers.pop(channel.id, []), key=lambda buffered: buffered.org_id)
+        for digest_applications in self._split(applications):
+            digest = _Digest(channel, digest_applications)
+            for application in digest.applications:
+                self._applications[(channel.guild.id, application.user_id, application.org_id)] = \
+                    (application, digest)
+            digest.rendered = self._render(digest.applications)
+            self._action_queue.send(channel, digest.rendered, lambda message, sent=digest: self._sent(sent, message))
+
+    def _split(self, applications: list[JoinApplication]) -> list[list[JoinApplication]]:
+        digests = [[]]
+        for application in applications:
+            candidate = digests[-1] + [application]
+            if digests[-1] and (len(candidate) > _MAX_APPLICATIONS_PER_DIGEST
+                                or self._resolved_length(candidate) > _MAX_MESSAGE_LENGTH):
+                digests.append([application])
+            else:
+                digests[-1] = candidate
+        return [digest for digest in digests if digest]
+
+    def _resolved_length(self, applications: list[JoinApplication]) -> int:
+        # Resolved entries render longer, and a digest is edited in place, so it has to fit once every entry is resolved
+        return max(len(self._render([_with_status(application, status) for application in applications]))
+                   for status in (ApplicationStatus.approved, ApplicationStatus.rejected))
+
+    def _sent(self, digest: _Digest, message: discord.Message):
+        digest.message_id = message.id
+        self._refresh(digest)
+
+    def _refresh(self, digest: _Digest):
+        if digest.message_id is None:
+            return
+        rendered = self._render(digest.applications)
+        if rendered != digest.rendered:
+            digest.rendered = rendered
+            self._action_queue.edit_message(digest.channel, digest.message_id, rendered)
+        if all(application.status != ApplicationStatus.pending for application in digest.applications):
+            for application in digest.applications:
+                key = (digest.channel.guild.id, application.user_id, application.org_id)
+                if self._applications.get(key, (None,))[0] is application:
+                    del self._applications[key]
+
+
+def _with_status(application: JoinApplication, status: ApplicationStatus) -> JoinApplication:
+    copy = JoinApplication(application.user_id, application.nick, application.org_id)
+    copy.status = status
+    return copy
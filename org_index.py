@@ -0,0 +1,66 @@
+import bisect
+import threading
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+_MAX_NGRAM = 3
+
+_IndexKey = tuple[str, str]
+
+
+class OrgNameIndex:
+    def __init__(self, names: Iterable[str] = ()):
+        self._lock = threading.Lock()
+        self._keys: list[_IndexKey] = []
+        # Every posting list is kept sorted, so substring matches can be streamed in order without sorting
+        self._ngrams: dict[str, list[_IndexKey]] = {}
+        self.reset(names)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def reset(self, names: Iterable[str]):
+        with self._lock:
+            self._keys = sorted(set((name.casefold(), name) for name in names))
+            self._ngrams = {}
+            for key in self._keys:
+                for ngram in _ngrams(key[0]):
+                    self._ngrams.setdefault(ngram, []).append(key)
+
+    def add(self, name: str):
+        key = (name.casefold(), name)
+        with self._lock:
+            position = bisect.bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                return
+            self._keys.insert(position, key)
+            for ngram in _ngrams(key[0]):
+                bisect.insort(self._ngrams.setdefault(ngram, []), key)
+
+    def search(self, value: str, accept: Callable[[str], bool] = None, limit: int = 25) -> list[str]:
+        with self._lock:
+            return list(islice(filter(accept or _accept_all, self._ranked(value.casefold())), limit))
+
+    def _ranked(self, folded_value: str) -> Iterator[str]:
+        if not folded_value:
+            yield from (name for _, name in self._keys)
+            return
+        # Prefix matches come first and form a contiguous, already sorted range of the key list
+        position = bisect.bisect_left(self._keys, (folded_value,))
+        while position < len(self._keys) and self._keys[position][0].startswith(folded_value):
+            yield self._keys[position][1]
+            position += 1
+        # The shortest posting list of the value's n-grams holds every substring match, in key order
+        postings = min((self._ngrams.get(folded_value[start:start + _MAX_NGRAM], ())
+                        for start in range(max(len(folded_value) - _MAX_NGRAM + 1, 1))), key=len)
+        yield from (name for folded, name in postings
+                    if folded_value in folded and not folded.startswith(folded_value))
+
+
+def _ngrams(folded: str) -> set[str]:
+    return {folded[start:start + length] for length in range(1, _MAX_NGRAM + 1)
+            for start in range(len(folded) - length + 1)}
+
+
+def _accept_all(_: str) -> bool:
+    return True
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from discord import Member
+
+import async_database
+import database
+
+ADMIN_LEVEL = 3
+
+
+class ResolvedPermissions:
+    def __init__(self, memberships: database.Memberships, administrator: bool):
+        self._memberships = memberships
+        self.administrator = administrator
+        self.max_level = ADMIN_LEVEL if administrator else memberships.max_level
+
+    def __repr__(self):
+        return f"ResolvedPermissions administrator: {self.administrator}, {self._memberships}"
+
+    def level(self, org_id: int) -> int:
+        if self.administrator:
+            return ADMIN_LEVEL
+        return self._memberships.level(org_id) or 0
+
+
+class PermissionResolver:
+    def __init__(self, ttl: float = 300.0):
+        self._ttl = ttl
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # Only touched on the event loop; invalidations from database worker threads are handed over to it
+        self._cache: dict[int, dict[int, tuple[float, database.Memberships]]] = {}
+        self._generations: dict[int, dict[int, int]] = {}
+        database.add_user_listener(self.invalidate)
+
+    async def resolve(self, member: Member) -> ResolvedPermissions:
+        self._loop = asyncio.get_running_loop()
+        guild_cache = self._cache.setdefault(member.guild.id, {})
+        cached = guild_cache.get(member.id)
+        if cached is None or cached[0] < time.monotonic():
+            generations = self._generations.setdefault(member.guild.id, {})
+            generation = generations.get(member.id, 0)
+            cached = (time.monotonic() + self._ttl, await async_database.get_memberships(member.guild.id, member.id))
+            # An invalidation that arrived while fetching may describe a write the fetched memberships predate
+            if generations.get(member.id, 0) == generation:
+                guild_cache[member.id] = cached
+        return ResolvedPermissions(cached[1], member.guild_permissions.administrator)
+
+    def invalidate(self, guild_id: int, member_id: int):
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._invalidate, guild_id, member_id)
+
+    def _invalidate(self, guild_id: int, member_id: int):
+        generations = self._generations.setdefault(guild_id, {})
+        generations[member_id] = generations.get(member_id, 0) + 1
+        self._cache.get(guild_id, {}).pop(member_id, None)
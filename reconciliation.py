@@ -0,0 +1,114 @@
+import threading
+
+from discord import Guild, Member
+
+import async_database
+import database
+from action_queue import ActionQueue
+
+# Moderator and admin memberships are never removed to match roles, only reported
+_PROTECTED_LEVEL = 2
+
+
+class RoleDrift:
+    def __init__(self):
+        self.missing_roles: dict[int, set[int]] = {}
+        self.extra_roles: dict[int, set[int]] = {}
+        self.protected_roles: dict[int, set[int]] = {}
+
+    def __bool__(self):
+        return bool(self.missing_roles or self.extra_roles)
+
+    def __repr__(self):
+        return f"RoleDrift missing: {self.missing_count}, extra: {self.extra_count}, protected: {self.protected_count}"
+
+    @property
+    def missing_count(self) -> int:
+        return sum(len(org_ids) for org_ids in self.missing_roles.values())
+
+    @property
+    def extra_count(self) -> int:
+        return sum(len(org_ids) for org_ids in self.extra_roles.values())
+
+    @property
+    def protected_count(self) -> int:
+        return sum(len(org_ids) for org_ids in self.protected_roles.values())
+
+    def compare(self, member_id: int, held: set[int], approved: set[int]):
+        if approved - held:
+            self.missing_roles[member_id] = approved - held
+        if held - approved:
+            self.extra_roles[member_id] = held - approved
+
+
+class Reconciler:
+    def __init__(self, action_queue: ActionQueue):
+        self._action_queue = action_queue
+        # Database worker threads mark members dirty while the event loop diffs them
+        self._dirty_lock = threading.Lock()
+        self._dirty: dict[int, set[int]] = {}
+        self._scanned: set[int] = set()
+        database.add_user_listener(self.mark_dirty)
+
+    def mark_dirty(self, guild_id: int, member_id: int):
+        with self._dirty_lock:
+            self._dirty.setdefault(guild_id, set()).add(member_id)
+
+    def _pop_dirty(self, guild_id: int) -> set[int]:
+        with self._dirty_lock:
+            return self._dirty.pop(guild_id, set())
+
+    def on_member_update(self, before: Member, after: Member):
+        if before.roles != after.roles:
+            self.mark_dirty(after.guild.id, after.id)
+
+    async def diff(self, guild: Guild, full: bool = False) -> RoleDrift:
+        org_role_ids = {org_id for org_id in await async_database.get_org_ids(guild.id) if guild.get_role(org_id)}
+        drift = RoleDrift()
+        if full or guild.id not in self._scanned:
+            self._pop_dirty(guild.id)
+            approved = await async_database.get_approved_org_ids(guild.id)
+            for member in guild.members:
+                if self._settling(guild.id, member.id):
+                    continue
+                held = {role.id for role in member.roles} & org_role_ids
+                drift.compare(member.id, held, approved.get(member.id, set()) & org_role_ids)
+            self._scanned.add(guild.id)
+            return drift
+        for member_id in self._pop_dirty(guild.id):
+            member = guild.get_member(member_id)
+            if not member or self._settling(guild.id, member_id):
+                continue
+            held = {role.id for role in member.roles} & org_role_ids
+            memberships = await async_database.get_memberships(guild.id, member_id)
+            drift.compare(member_id, held, memberships.members & org_role_ids)
+        return drift
+
+    def _settling(self, guild_id: int, member_id: int) -> bool:
+        # Roles lag behind the database until the member's queued, retrying or failed edit has gone through, so the
+        # member is compared again on a later pass instead
+        if self._action_queue.has_pending_edit(guild_id, member_id):
+            self.mark_dirty(guild_id, member_id)
+            return True
+        return False
+
+    def apply_to_roles(self, guild: Guild, drift: RoleDrift):
+        for member_id in drift.missing_roles.keys() | drift.extra_roles.keys():
+            member = guild.get_member(member_id)
+            if member:
+                self._action_queue.edit_member(
+                    member,
+                    add_roles=[guild.get_role(org_id) for org_id in drift.missing_roles.get(member_id, ())],
+                    remove_roles=[guild.get_role(org_id) for org_id in drift.extra_roles.get(member_id, ())])
+
+    async def apply_to_database(self, guild: Guild, drift: RoleDrift):
+        additions = [(member_id, org_id) for member_id, org_ids in drift.extra_roles.items() for org_id in org_ids]
+        removals = []
+        for member_id, org_ids in drift.missing_roles.items():
+            memberships = await async_database.get_memberships(guild.id, member_id)
+            for org_id in org_ids:
+                if (memberships.level(org_id) or 0) >= _PROTECTED_LEVEL:
+                    drift.protected_roles.setdefault(member_id, set()).add(org_id)
+                else:
+                    removals.append((member_id, org_id))
+        await async_database.set_memberships(guild.id, additions, removals)
@@ -0,0 +1,106 @@
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import tempfile
+from typing import Callable
+
+_logger = logging.getLogger(__name__)
+
+
+class SettingsService:
+    def __init__(self, path: str, debounce: float = 1.0):
+        self._path = path
+        self._debounce = debounce
+        self._settings = self._read()
+        self._subscribers: list[Callable[[int, str, object], None]] = []
+        self._changed_guilds: set[str] = set()
+        self._flush_task: asyncio.Task | None = None
+        self._write_lock = asyncio.Lock()
+
+    def __repr__(self):
+        return f"SettingsService '{self._path}', {len(self._guilds())} guilds"
+
+    def adopt_legacy_settings(self, guild_id: int):
+        if "admin_channel_id" in self._settings:
+            self._guilds().setdefault(str(guild_id), {}).setdefault("admin_channel_id",
+                                                                     self._settings.pop("admin_channel_id"))
+            self._write({str(guild_id): self._guilds()[str(guild_id)]}, adopt_legacy_settings=True)
+
+    def subscribe(self, subscriber: Callable[[int, str, object], None]):
+        self._subscribers.append(subscriber)
+
+    def admin_channel_id(self, guild_id: int) -> int | None:
+        return self._get(guild_id, "admin_channel_id")
+
+    def set_admin_channel_id(self, guild_id: int, channel_id: int):
+        self._set(guild_id, "admin_channel_id", channel_id)
+
+    async def flush(self):
+        async with self._write_lock:
+            changed_guilds, self._changed_guilds = self._changed_guilds, set()
+            if not changed_guilds:
+                return
+            try:
+                await asyncio.to_thread(self._write, {guild_id: dict(self._guilds()[guild_id])
+                                                      for guild_id in changed_guilds})
+            except BaseException:
+                self._changed_guilds |= changed_guilds
+                raise
+
+    def _guilds(self) -> dict[str, dict]:
+        return self._settings.setdefault("guilds", {})
+
+    def _get(self, guild_id: int, key: str, default=None):
+        return self._guilds().get(str(guild_id), {}).get(key, default)
+
+    def _set(self, guild_id: int, key: str, value):
+        if self._get(guild_id, key) == value:
+            return
+        self._guilds().setdefault(str(guild_id), {})[key] = value
+        self._changed_guilds.add(str(guild_id))
+        for subscriber in self._subscribers:
+            subscriber(guild_id, key, value)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._debounce)
+        try:
+            await self.flush()
+        except OSError:
+            _logger.exception("Writing %s failed", self._path)
+
+    def _read(self) -> dict:
+        if not os.path.exists(self._path):
+            return {}
+        with open(self._path, "r", encoding="utf-8") as settings_file:
+            return json.load(settings_file)
+
+    def _write(self, changed_guilds: dict[str, dict], adopt_legacy_settings: bool = False):
+        directory = os.path.dirname(self._path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # Shard processes share the file, so each read, merge and replace holds an exclusive lock for its duration
+        with open(self._path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._merge_and_replace(changed_guilds, adopt_legacy_settings, directory)
+
+    def _merge_and_replace(self, changed_guilds: dict[str, dict], adopt_legacy_settings: bool, directory: str):
+        # Other shard processes may have written their own guilds' settings since this process loaded the file.
+        # The legacy top level setting is kept until the process serving its guild has adopted it.
+        stored_settings = self._read()
+        if adopt_legacy_settings:
+            stored_settings.pop("admin_channel_id", None)
+        stored_guilds = stored_settings.setdefault("guilds", {})
+        stored_guilds.update(changed_guilds)
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=".settings-", suffix=".json")
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as settings_file:
+                json.dump(stored_settings, settings_file, ensure_ascii=False, indent=2)
+                settings_file.flush()
+                os.fsync(settings_file.fileno())
+            os.replace(temporary_path, self._path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
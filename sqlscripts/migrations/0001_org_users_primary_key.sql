@@ -0,0 +1,19 @@
+CREATE TABLE OrgUsersMigrated (
+    UserID INTEGER NOT NULL,
+    OrgID INTEGER NOT NULL,
+    PermissionLevel INTEGER DEFAULT 0,
+    PRIMARY KEY (UserID, OrgID),
+    FOREIGN KEY (UserID) REFERENCES Users(ID) ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (OrgID) REFERENCES Orgs(ID) ON DELETE CASCADE ON UPDATE CASCADE
+) WITHOUT ROWID;
+
+INSERT INTO OrgUsersMigrated (UserID, OrgID, PermissionLevel)
+    SELECT UserID, OrgID, MAX(PermissionLevel) FROM OrgUsers
+    WHERE UserID IS NOT NULL AND OrgID IS NOT NULL
+    GROUP BY UserID, OrgID;
+
+DROP TABLE OrgUsers;
+
+ALTER TABLE OrgUsersMigrated RENAME TO OrgUsers;
+
+CREATE INDEX OrgUsersOrgID ON OrgUsers (OrgID);
@@ -0,0 +1 @@
+CREATE INDEX OrgUsersPending ON OrgUsers (OrgID, UserID) WHERE PermissionLevel = 0;
@@ -0,0 +1,13 @@
+CREATE TABLE AuditLog (
+    ID INTEGER PRIMARY KEY,
+    Time INTEGER NOT NULL,
+    ActorID INTEGER,
+    Action VARCHAR(32) NOT NULL,
+    UserID INTEGER,
+    OrgID INTEGER,
+    PermissionLevel INTEGER,
+    Detail TEXT
+);
+CREATE INDEX AuditLogUser ON AuditLog (UserID, ID);
+CREATE INDEX AuditLogOrg ON AuditLog (OrgID, ID);
+CREATE INDEX AuditLogTime ON AuditLog (Time);
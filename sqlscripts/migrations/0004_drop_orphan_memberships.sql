@@ -0,0 +1 @@
+DELETE FROM OrgUsers WHERE UserID NOT IN (SELECT ID FROM Users) OR OrgID NOT IN (SELECT ID FROM Orgs);
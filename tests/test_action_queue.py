@@ -0,0 +1,76 @@
+import asyncio
+
+from action_queue import ActionQueue, _MemberEdit
+from benchmarks.stubs import StubGuild, StubMember, StubRole
+
+
+def _guild_with_member() -> tuple[StubGuild, StubMember, list[StubRole]]:
+    guild = StubGuild(1)
+    roles = [StubRole(role_id, f"role {role_id}") for role_id in (10, 11, 12)]
+    for role in roles:
+        guild.add_role(role)
+    member = StubMember(100, guild)
+    guild.add_member(member)
+    return guild, member, roles
+
+
+def test_merge_keeps_the_latest_change_per_role():
+    _, member, (first, second, third) = _guild_with_member()
+    edit = _MemberEdit(member)
+    edit.merge("nick", [first, second], [third])
+    edit.merge(None, [third], [first])
+    assert edit.nick == "nick"
+    assert set(edit.add_roles) == {second.id, third.id}
+    assert set(edit.remove_roles) == {first.id}
+
+
+def test_merge_keeps_the_latest_nick():
+    _, member, _ = _guild_with_member()
+    edit = _MemberEdit(member)
+    edit.merge("first", [], [])
+    edit.merge("second", [], [])
+    assert edit.nick == "second"
+
+
+def test_apply_sends_only_the_queued_changes_to_the_current_member():
+    guild, member, (first, second, third) = _guild_with_member()
+    edit = _MemberEdit(member)
+    edit.merge(None, [first], [second])
+    # Roles changed after the edit was queued are neither restored nor dropped
+    current = StubMember(member.id, guild)
+    current.roles = [second, third]
+    guild.add_member(current)
+    asyncio.run(edit.apply())
+    assert current.roles == [third, first]
+    assert member.roles == []
+
+
+def test_apply_skips_members_who_left():
+    guild, member, (first, _, _) = _guild_with_member()
+    edit = _MemberEdit(member)
+    edit.merge("nick", [first], [])
+    guild._members_by_id.clear()
+    asyncio.run(edit.apply())
+    assert member.roles == [] and member.nick is None
+
+
+def test_edits_for_the_same_user_in_two_guilds_are_kept_apart():
+    members = []
+    for guild_id, role_id in ((1, 10), (2, 20)):
+        guild = StubGuild(guild_id)
+        guild.add_role(StubRole(role_id, f"role {role_id}"))
+        guild.add_member(StubMember(100, guild))
+        members.append(guild.get_member(100))
+
+    async def scenario():
+        action_queue = ActionQueue(bucket_interval=0)
+        for member in members:
+            action_queue.edit_member(member, add_roles=(member.guild.roles[0],))
+        assert action_queue.has_pending_edit(2, 100)
+        await action_queue.drain()
+        return action_queue
+
+    action_queue = asyncio.run(scenario())
+    assert [[role.id for role in member.roles] for member in members] == [[10], [20]]
+    assert action_queue.stats["merged"] == 0
+    assert not action_queue.has_pending_edit(1, 100)
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def guild_database(tmp_path):
+    guild_database = database.GuildDatabase(1, database.connect(str(tmp_path / "guild.sqlite")))
+    guild_database.init_database()
+    guild_database.load_cache()
+    yield guild_database
+    guild_database.con.close()
+
+
+def _actions(guild_database: database.GuildDatabase, **filters) -> list[tuple]:
+    return [(action, user_id, org_id, level) for _, _, _, action, user_id, org_id, level, _
+            in guild_database.get_history(**filters)]
+
+
+def test_membership_changes_are_audited_with_the_actor(guild_database):
+    guild_database.add_org(database.Org(10, "Miners"))
+    token = database.audit_actor.set(7)
+    try:
+        user = guild_database.get_user(100)
+        user.orgs.append(database.OrgPermissions(guild_database.get_org(10), 0))
+        guild_database.update_user(user)
+        user = guild_database.get_user(100)
+        user.orgs[0].permission_level = 1
+        guild_database.update_user(user)
+        user.orgs[0].permission_level = 2
+        guild_database.update_user(user)
+        guild_database.delete_user_org(user.orgs[0], 100)
+    finally:
+        database.audit_actor.reset(token)
+    assert _actions(guild_database, user_id=100) == [("left", 100, 10, 2), ("permission_changed", 100, 10, 2),
+                                                     ("approved", 100, 10, 1), ("applied", 100, 10, 0)]
+    assert {entry[2] for entry in guild_database.get_history(user_id=100)} == {7}
+    assert _actions(guild_database, org_id=10)[-1] == ("org_added", None, 10, None)
+
+
+def test_unchanged_users_write_no_entries(guild_database):
+    guild_database.add_org(database.Org(10, "Miners"))
+    user = guild_database.get_user(100)
+    user.orgs.append(database.OrgPermissions(guild_database.get_org(10), 1))
+    guild_database.update_user(user)
+    guild_database.update_user(guild_database.get_user(100))
+    assert len(guild_database.get_history(user_id=100)) == 1
+
+
+def test_history_pages_are_keyed_by_entry_id(guild_database):
+    guild_database._audit_many(("joined", user_id % 2, 10, 1, None) for user_id in range(45))
+    pages, before_id = [], None
+    while page := guild_database.get_history(user_id=1, before_id=before_id, limit=10):
+        pages.append([entry[0] for entry in page])
+        before_id = page[-1][0]
+    assert [len(page) for page in pages] == [10, 10, 2]
+    ids = [entry_id for page in pages for entry_id in page]
+    assert ids == sorted(ids, reverse=True) and len(set(ids)) == 22
+
+
+def test_compaction_deletes_old_entries_one_batch_per_call(guild_database):
+    guild_database._audit_many(("joined", user_id, 10, 1, None) for user_id in range(25))
+    old = int(time.time()) - 10 * 86400
+    guild_database.con.execute("UPDATE AuditLog SET Time = ? WHERE UserID < 20", (old,))
+    guild_database.con.commit()
+    removed = [guild_database.compact_audit_log(5, limit=8) for _ in range(4)]
+    assert removed == [8, 8, 4, 0]
+    assert sorted(entry[4] for entry in guild_database.get_history()) == list(range(20, 25))
@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+import async_database
+import database
+from action_queue import ActionQueue
+from benchmarks.stubs import StubChannel, StubGuild, StubInteraction, StubMember, StubRole
+from permission_resolver import PermissionResolver
+
+GUILD_ID = 1
+ADMIN_ID = 2
+
+
+@pytest.fixture(scope="module")
+def main(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv("GUILD", str(GUILD_ID))
+        patch.setenv("SETTINGS_PATH", str(tmp_path_factory.mktemp("settings") / "settings.json"))
+        patch.setenv("APPLICATION_DIGEST_SECONDS", "0")
+        patch.setattr(database, "_served_guild_ids", database._served_guild_ids)
+        import main
+        yield main
+
+
+@pytest.fixture
+def bot(main, monkeypatch, tmp_path):
+    # Every test runs its own event loop, so loop-bound queues and caches start from scratch
+    monkeypatch.setattr(database, "_DATABASE_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(database, "_databases", {})
+    monkeypatch.setattr(main, "action_queue", ActionQueue(bucket_interval=0))
+    monkeypatch.setattr(main.application_notifier, "_action_queue", main.action_queue)
+    monkeypatch.setattr(main.application_notifier, "_applications", {})
+    monkeypatch.setattr(main, "permission_resolver", PermissionResolver())
+    guild = StubGuild(GUILD_ID)
+    guild.channels[3] = StubChannel(3, guild)
+    guild.add_member(StubMember(ADMIN_ID, guild, administrator=True))
+    for org_id in (10, 11):
+        guild.add_role(StubRole(org_id, f"Org {org_id}"))
+    return main, guild, database.for_guild(GUILD_ID)
+
+
+def _seed(guild_database: database.GuildDatabase, guild: StubGuild, memberships: dict[int, dict[int, int]]):
+    guild_database.con.executemany("INSERT INTO Orgs (ID, Name) VALUES (?, ?)",
+                                   [(role.id, role.name) for role in guild.roles])
+    for user_id, org_levels in memberships.items():
+        guild.add_member(StubMember(user_id, guild))
+        guild_database.con.execute("INSERT INTO Users (ID, Nick) VALUES (?, ?)", (user_id, f"Nick {user_id}"))
+        guild_database.con.executemany("INSERT INTO OrgUsers (UserID, OrgID, PermissionLevel) VALUES (?, ?, ?)",
+                                       [(user_id, org_id, level) for org_id, level in org_levels.items()])
+    guild_database.con.commit()
+    guild_database.load_cache()
+
+
+def _run(main, coroutine):
+    async def scenario():
+        result = await coroutine
+        await main.action_queue.drain()
+        return result
+    return asyncio.run(scenario())
+
+
+def test_reject_removes_only_the_rejected_application(bot):
+    main, guild, guild_database = bot
+    _seed(guild_database, guild, {100: {10: 1, 11: 0}})
+    admin = guild.get_member(ADMIN_ID)
+    _run(main, main.reject.callback(StubInteraction(admin), guild.get_member(100), guild_database.get_org(11)))
+    assert guild_database.get_memberships(100).level(10) == 1
+    assert guild_database.get_memberships(100).level(11) is None
+    assert guild_database.get_user(100).nick == "Nick 100"
+    assert [(entry[3], entry[5]) for entry in guild_database.get_history(user_id=100)] == [("rejected", 11)]
+
+
+@pytest.mark.parametrize("command", ["approve", "reject"])
+def test_moderators_of_another_org_cannot_handle_applications(bot, command):
+    main, guild, guild_database = bot
+    _seed(guild_database, guild, {100: {10: 1, 11: 0}, 101: {10: 2}})
+    interaction = StubInteraction(guild.get_member(101))
+    _run(main, getattr(main, command).callback(interaction, guild.get_member(100), guild_database.get_org(11)))
+    assert guild_database.get_memberships(100).level(11) == 0
+    assert "<@101>" in interaction.response.messages[0]
+
+
+def test_approve_updates_the_approved_application(bot):
+    main, guild, guild_database = bot
+    _seed(guild_database, guild, {100: {10: 1, 11: 0}})
+    member = guild.get_member(100)
+    _run(main, main.approve.callback(StubInteraction(guild.get_member(ADMIN_ID)), member, guild_database.get_org(11)))
+    assert guild_database.get_memberships(100).level(10) == 1
+    assert guild_database.get_memberships(100).level(11) == 1
+    assert [role.id for role in member.roles] == [11]
+
+
+def test_application_digests_fit_in_a_message_when_resolved(bot):
+    main, guild, _ = bot
+    applications = []
+    for index in range(20):
+        application = main.JoinApplication(10 ** 17 + index, "n" * 32, 10 ** 18 + index)
+        application.status = main.ApplicationStatus.rejected
+        applications.append(application)
+    assert len(main.render_application_digest(applications)) > 2000
+    digests = main.application_notifier._split(applications)
+    assert len(digests) > 1
+    for digest in digests:
+        assert main.application_notifier._resolved_length(digest) <= 2000
+
+
+def test_history_pages_end_before_the_message_limit(main):
+    snowflake = 1_000_000_000_000_000_000
+    entries = [(entry_id, 1_700_000_000, snowflake, "permission_changed", snowflake, snowflake, 3, None)
+               for entry_id in range(main._HISTORY_PAGE_SIZE, 0, -1)]
+    content, shown = main.render_history_page(entries)
+    assert len(content) <= main._MAX_MESSAGE_LENGTH
+    assert 0 < shown < len(entries)
+    assert content.count("\n") == shown
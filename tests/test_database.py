@@ -0,0 +1,18 @@
+import asyncio
+
+import pytest
+
+import async_database
+import database
+
+
+def test_unserved_guilds_get_no_database_or_worker(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, "_DATABASE_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(database, "_served_guild_ids", set())
+    database.serve_guilds([1])
+    with pytest.raises(database.UnservedGuild):
+        database.for_guild(2)
+    with pytest.raises(database.UnservedGuild):
+        asyncio.run(async_database.add_user(2, 100))
+    assert 2 not in async_database._executors
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,51 @@
+import threading
+from types import SimpleNamespace
+
+from discord import InteractionType
+
+import metrics
+
+
+def _interaction(name: str, kind: InteractionType = InteractionType.application_command):
+    return SimpleNamespace(type=kind, data={"name": name}, extras={})
+
+
+def test_render_while_worker_threads_add_labels():
+    stop = threading.Event()
+
+    def record():
+        for label in range(500):
+            if stop.is_set():
+                return
+            metrics.increment("test_render_total", str(label))
+            metrics.observe("test_render_seconds", str(label), 0.001)
+
+    workers = [threading.Thread(target=record) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    try:
+        for _ in range(50):
+            metrics.render()
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+    assert 'test_render_total{name="0"}' in metrics.render()
+
+
+def test_interaction_trace_records_database_time_once():
+    interaction = _interaction("join")
+    metrics.start_interaction(interaction)
+    metrics.record_database_call("get_user", 0.002)
+    assert interaction.extras["trace"].database_seconds == 0.002
+    metrics.finish_interaction(interaction)
+    metrics.finish_interaction(interaction)
+    assert 'bot_command_seconds_count{name="join"} 1' in metrics.render()
+
+
+def test_slow_interactions_are_logged(monkeypatch, caplog):
+    monkeypatch.setattr(metrics, "_SLOW_INTERACTION_SECONDS", 0)
+    interaction = _interaction("org", InteractionType.autocomplete)
+    metrics.start_interaction(interaction)
+    metrics.finish_interaction(interaction)
+    assert "Slow interaction 'autocomplete org'" in caplog.text
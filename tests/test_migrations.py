@@ -0,0 +1,49 @@
+import os
+import sqlite3
+
+import database
+
+
+def _legacy_database(path: str):
+    connection = sqlite3.connect(path)
+    for table in ("orgs", "users", "org_users"):
+        with open(os.path.join("sqlscripts", f"create_{table}.sql"), "r", encoding="utf-8") as sql_script:
+            connection.execute(sql_script.read())
+    connection.executemany("INSERT INTO Orgs (ID, Name) VALUES (?, ?)", [(10, "Miners"), (11, "Traders")])
+    connection.executemany("INSERT INTO Users (ID, Nick) VALUES (?, ?)", [(1, "one"), (2, "two")])
+    connection.executemany("INSERT INTO OrgUsers (UserID, OrgID, PermissionLevel) VALUES (?, ?, ?)",
+                           [(1, 10, 0), (1, 10, 2), (2, 11, 1), (3, 10, 1), (2, 99, 1), (None, 10, 1)])
+    connection.commit()
+    connection.close()
+
+
+def _migrated(path: str) -> database.GuildDatabase:
+    guild_database = database.GuildDatabase(1, database.connect(path))
+    guild_database.init_database()
+    return guild_database
+
+
+def test_fresh_database_is_migrated_to_latest_version(tmp_path):
+    guild_database = _migrated(str(tmp_path / "fresh.sqlite"))
+    latest = max(int(name.split("_", 1)[0]) for name in os.listdir(os.path.join("sqlscripts", "migrations")))
+    assert guild_database.get_schema_version() == latest
+    assert guild_database.check_query_plans() == []
+    assert guild_database.con.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+
+def test_legacy_memberships_are_deduplicated_and_orphans_dropped(tmp_path):
+    path = str(tmp_path / "legacy.sqlite")
+    _legacy_database(path)
+    guild_database = _migrated(path)
+    rows = guild_database.con.execute("SELECT UserID, OrgID, PermissionLevel FROM OrgUsers ORDER BY UserID").fetchall()
+    assert rows == [(1, 10, 2), (2, 11, 1)]
+    assert guild_database.con.execute("PRAGMA foreign_key_check").fetchall() == []
+
+
+def test_migrating_again_is_a_no_op(tmp_path):
+    path = str(tmp_path / "again.sqlite")
+    _legacy_database(path)
+    version = _migrated(path).get_schema_version()
+    guild_database = _migrated(path)
+    assert guild_database.get_schema_version() == version
+    assert guild_database.con.execute("SELECT COUNT(*) FROM OrgUsers").fetchone()[0] == 2
@@ -0,0 +1,90 @@
+import asyncio
+
+from action_queue import ActionQueue
+from benchmarks.stubs import StubChannel, StubGuild
+from notifications import ApplicationStatus, JoinApplication, JoinApplicationNotifier
+
+
+def _render(applications: list[JoinApplication]) -> str:
+    lines = [f"{len(applications)} applications:"]
+    for application in applications:
+        entry = f"<@{application.user_id}> {application.nick} to <@&{application.org_id}>"
+        if application.status != ApplicationStatus.pending:
+            entry = f"~~{entry}~~ {application.status.name}"
+        lines.append(entry)
+    return "\n".join(lines)
+
+
+def _notifier(render=_render) -> tuple[JoinApplicationNotifier, StubChannel]:
+    channel = StubChannel(5, StubGuild(1))
+    return JoinApplicationNotifier(ActionQueue(bucket_interval=0), render, window=0), channel
+
+
+async def _settle(notifier: JoinApplicationNotifier):
+    await asyncio.gather(*notifier._flushes.values())
+    await notifier._action_queue.drain()
+
+
+def test_applications_within_the_window_share_one_digest():
+    notifier, channel = _notifier()
+
+    async def scenario():
+        notifier.add(channel, 100, "First", 11)
+        notifier.add(channel, 101, "Second", 10)
+        await _settle(notifier)
+
+    asyncio.run(scenario())
+    assert channel.sent == ["2 applications:\n<@101> Second to <@&10>\n<@100> First to <@&11>"]
+
+
+def test_digests_are_split_to_fit_once_resolved():
+    # About 120 characters per entry, so fewer than 20 applications fit in one message
+    notifier, channel = _notifier(lambda applications: _render(applications).replace("\n", "\n" + "-" * 40 + "\n"))
+
+    async def scenario():
+        for user_id in range(60):
+            notifier.add(channel, user_id, "n" * 32, 1_000_000_000_000_000_000 + user_id)
+        await _settle(notifier)
+        for user_id in range(60):
+            notifier.resolve(1, user_id, 1_000_000_000_000_000_000 + user_id, approved=user_id % 2 == 0)
+        await _settle(notifier)
+
+    asyncio.run(scenario())
+    assert len(channel.sent) > 3
+    assert all(len(message) <= 2000 for message in channel.sent)
+    assert sum(message.count("~~") for message in channel.sent) == 120
+
+
+def test_application_resolved_before_the_digest_is_sent():
+    notifier, channel = _notifier()
+
+    async def scenario():
+        notifier.add(channel, 100, "First", 10)
+        notifier.resolve(1, 100, 10, approved=False)
+        await _settle(notifier)
+
+    asyncio.run(scenario())
+    assert channel.sent == ["1 applications:\n~~<@100> First to <@&10>~~ rejected"]
+    assert notifier._applications == {}
+
+
+def test_digest_is_edited_as_applications_are_resolved_and_then_forgotten():
+    notifier, channel = _notifier()
+
+    async def scenario():
+        notifier.add(channel, 100, "First", 10)
+        notifier.add(channel, 101, "Second", 10)
+        await _settle(notifier)
+        notifier.resolve(1, 100, 10, approved=True)
+        await _settle(notifier)
+        assert len(notifier._applications) == 2
+        notifier.resolve(1, 101, 10, approved=False)
+        # Once every entry is resolved the digest is forgotten, so later resolves leave it alone
+        notifier.resolve(1, 101, 10, approved=True)
+        await _settle(notifier)
+
+    asyncio.run(scenario())
+    assert channel.sent == ["2 applications:\n~~<@100> First to <@&10>~~ approved\n"
+                            "~~<@101> Second to <@&10>~~ rejected"]
+    assert notifier._applications == {}
+    assert notifier._action_queue.stats["failed"] == 0
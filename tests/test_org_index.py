@@ -0,0 +1,46 @@
+from org_index import OrgNameIndex
+
+
+def test_empty_value_lists_every_name_in_order():
+    index = OrgNameIndex(["beta", "Alpha", "gamma"])
+    assert index.search("") == ["Alpha", "beta", "gamma"]
+
+
+def test_prefix_matches_rank_before_substring_matches():
+    index = OrgNameIndex(["Star Citizens", "Citizen Corps", "The Citizens", "Outlaws"])
+    assert index.search("citizen") == ["Citizen Corps", "Star Citizens", "The Citizens"]
+
+
+def test_search_is_case_insensitive():
+    index = OrgNameIndex(["Mining Guild"])
+    assert index.search("GUILD") == ["Mining Guild"]
+    assert index.search("mIn") == ["Mining Guild"]
+
+
+def test_short_and_long_values_match_substrings():
+    index = OrgNameIndex(["abcdef", "xabcx", "xbcdx"])
+    assert index.search("bc") == ["abcdef", "xabcx", "xbcdx"]
+    assert index.search("bcde") == ["abcdef"]
+    assert index.search("abcx") == ["xabcx"]
+    assert index.search("bcdf") == []
+
+
+def test_limit_and_accept_apply_after_ranking():
+    names = [f"org {number:03}" for number in range(100)]
+    index = OrgNameIndex(names)
+    assert index.search("org", limit=3) == ["org 000", "org 001", "org 002"]
+    assert index.search("0", accept=lambda name: name.endswith("5"), limit=2) == ["org 005", "org 015"]
+
+
+def test_added_names_are_found_in_order():
+    index = OrgNameIndex(["Zeta traders", "Alpha traders"])
+    index.add("Mid traders")
+    index.add("Mid traders")
+    assert len(index) == 3
+    assert index.search("traders") == ["Alpha traders", "Mid traders", "Zeta traders"]
+
+
+def test_reset_replaces_names():
+    index = OrgNameIndex(["Old org"])
+    index.reset(["New org"])
+    assert index.search("org") == ["New org"]
@@ -0,0 +1,75 @@
+import pytest
+
+import database
+
+_PENDING = database._BATCH_SIZE * 2 + 3
+
+
+@pytest.fixture
+def guild_database(tmp_path):
+    guild_database = database.GuildDatabase(1, database.connect(str(tmp_path / "guild.sqlite")))
+    guild_database.init_database()
+    guild_database.con.executemany("INSERT INTO Orgs (ID, Name) VALUES (?, ?)", [(10, "Miners"), (11, "Traders")])
+    guild_database.con.executemany("INSERT INTO Users (ID, Nick) VALUES (?, ?)",
+                                   [(user_id, f"Nick {user_id}") for user_id in range(1, _PENDING + 2)])
+    guild_database.con.executemany("INSERT INTO OrgUsers (UserID, OrgID, PermissionLevel) VALUES (?, 10, 0)",
+                                   [(user_id,) for user_id in range(1, _PENDING + 1)])
+    guild_database.con.execute("INSERT INTO OrgUsers (UserID, OrgID, PermissionLevel) VALUES (?, 10, 2)",
+                               (_PENDING + 1,))
+    guild_database.con.execute("INSERT INTO OrgUsers (UserID, OrgID, PermissionLevel) VALUES (1, 11, 0)")
+    guild_database.con.commit()
+    guild_database.load_cache()
+    yield guild_database
+    guild_database.con.close()
+
+
+def _audited(guild_database: database.GuildDatabase, action: str) -> int:
+    return guild_database.con.execute("SELECT COUNT(*) FROM AuditLog WHERE Action = ?", (action,)).fetchone()[0]
+
+
+def test_pending_pages_follow_user_ids(guild_database):
+    first_page = guild_database.get_pending(10, limit=20)
+    assert [user_id for user_id, _ in first_page] == list(range(1, 21))
+    assert first_page[0] == (1, "Nick 1")
+    last_page = guild_database.get_pending(10, _PENDING - 2, 20)
+    assert [user_id for user_id, _ in last_page] == [_PENDING - 1, _PENDING]
+    assert guild_database.count_pending(10) == _PENDING
+
+
+def test_approve_pending_approves_every_page(guild_database):
+    guild_database.get_memberships(2)
+    approved = guild_database.approve_pending(10)
+    assert [user_id for user_id, _ in approved] == list(range(1, _PENDING + 1))
+    assert guild_database.count_pending(10) == 0
+    assert guild_database.get_memberships(2).level(10) == 1
+    assert guild_database.get_memberships(_PENDING + 1).level(10) == 2
+    assert guild_database.get_memberships(1).level(11) == 0
+    assert _audited(guild_database, "approved") == _PENDING
+
+
+def test_reject_pending_keeps_other_memberships(guild_database):
+    rejected = guild_database.reject_pending(10)
+    assert len(rejected) == _PENDING
+    assert guild_database.get_memberships(1).level(10) is None
+    assert guild_database.get_memberships(1).level(11) == 0
+    assert guild_database.get_user(1).nick == "Nick 1"
+    assert guild_database.get_memberships(_PENDING + 1).level(10) == 2
+    assert _audited(guild_database, "rejected") == _PENDING
+
+
+def test_failed_bulk_approval_changes_nothing(guild_database, monkeypatch):
+    def fail(_):
+        raise RuntimeError("audit log unavailable")
+
+    monkeypatch.setattr(guild_database, "_audit_many", fail)
+    with pytest.raises(RuntimeError):
+        guild_database.approve_pending(10)
+    assert guild_database.count_pending(10) == _PENDING
+    assert guild_database.get_memberships(2).level(10) == 0
+
+
+def test_bulk_changes_notify_user_listeners(guild_database, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(database, "_user_listeners", [lambda guild_id, user_id: invalidated.append(user_id)])
+    guild_database.reject_pending(11)
+    assert invalidated == [1]
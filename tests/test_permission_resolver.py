@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+import async_database
+import database
+from permission_resolver import PermissionResolver
+
+
+def _member(member_id: int = 1, guild_id: int = 10):
+    permissions = SimpleNamespace(administrator=False)
+    return SimpleNamespace(id=member_id, guild=SimpleNamespace(id=guild_id), guild_permissions=permissions)
+
+
+def test_memberships_are_cached_until_invalidated(monkeypatch):
+    fetched = []
+
+    async def get_memberships(guild_id, member_id):
+        fetched.append(member_id)
+        return database.Memberships({5: 2})
+
+    monkeypatch.setattr(async_database, "get_memberships", get_memberships)
+
+    async def scenario():
+        resolver = PermissionResolver()
+        member = _member()
+        assert (await resolver.resolve(member)).level(5) == 2
+        await resolver.resolve(member)
+        assert len(fetched) == 1
+        resolver.invalidate(member.guild.id, member.id)
+        await asyncio.sleep(0)
+        await resolver.resolve(member)
+        assert len(fetched) == 2
+
+    asyncio.run(scenario())
+
+
+def test_invalidation_during_fetch_is_not_lost(monkeypatch):
+    resolver = PermissionResolver()
+    member = _member()
+    levels = [{5: 1}, {5: 3}]
+
+    async def get_memberships(guild_id, member_id):
+        memberships = database.Memberships(levels.pop(0))
+        # The write lands on the worker after this read, before the caller resumes
+        resolver.invalidate(guild_id, member_id)
+        await asyncio.sleep(0)
+        return memberships
+
+    monkeypatch.setattr(async_database, "get_memberships", get_memberships)
+
+    async def scenario():
+        await resolver.resolve(_member())
+        assert (await resolver.resolve(member)).level(5) == 3
+
+    asyncio.run(scenario())
@@ -0,0 +1,91 @@
+import asyncio
+
+import async_database
+import database
+from action_queue import ActionQueue
+from benchmarks.stubs import StubGuild, StubMember, StubRole
+from reconciliation import Reconciler, RoleDrift
+
+
+def _guild() -> StubGuild:
+    guild = StubGuild(1)
+    for role_id in (10, 11):
+        guild.add_role(StubRole(role_id, f"org {role_id}"))
+    for member_id in (100, 101):
+        guild.add_member(StubMember(member_id, guild))
+    return guild
+
+
+def test_members_with_pending_edits_are_compared_on_a_later_pass(monkeypatch):
+    guild = _guild()
+
+    async def get_org_ids(_):
+        return {10, 11}
+
+    async def get_approved_org_ids(_):
+        return {100: {10}, 101: {11}}
+
+    monkeypatch.setattr(async_database, "get_org_ids", get_org_ids)
+    monkeypatch.setattr(async_database, "get_approved_org_ids", get_approved_org_ids)
+
+    async def scenario():
+        action_queue = ActionQueue(bucket_interval=0)
+        reconciler = Reconciler(action_queue)
+        action_queue.edit_member(guild.get_member(100), add_roles=(guild.get_role(10),))
+        drift = await reconciler.diff(guild)
+        assert drift.missing_roles == {101: {11}}
+        assert reconciler._pop_dirty(guild.id) == {100}
+
+    asyncio.run(scenario())
+
+
+def test_database_mode_keeps_moderator_memberships(monkeypatch):
+    removed = []
+
+    async def get_memberships(_, member_id):
+        return database.Memberships({10: 2 if member_id == 100 else 1})
+
+    async def set_memberships(_, additions, removals):
+        removed.extend(removals)
+
+    monkeypatch.setattr(async_database, "get_memberships", get_memberships)
+    monkeypatch.setattr(async_database, "set_memberships", set_memberships)
+    drift = RoleDrift()
+    drift.compare(100, set(), {10})
+    drift.compare(101, set(), {10})
+    asyncio.run(Reconciler(ActionQueue()).apply_to_database(_guild(), drift))
+    assert removed == [(101, 10)]
+    assert drift.protected_roles == {100: {10}}
+
+
+def test_members_whose_edit_failed_are_compared_again(monkeypatch):
+    guild = _guild()
+    member = guild.get_member(100)
+
+    async def add_roles(*_):
+        raise RuntimeError("missing permissions")
+
+    async def get_org_ids(_):
+        return {10, 11}
+
+    async def get_approved_org_ids(_):
+        return {100: {10}}
+
+    async def get_memberships(_, __):
+        return database.Memberships({10: 1})
+
+    monkeypatch.setattr(member, "add_roles", add_roles)
+    monkeypatch.setattr(async_database, "get_org_ids", get_org_ids)
+    monkeypatch.setattr(async_database, "get_approved_org_ids", get_approved_org_ids)
+    monkeypatch.setattr(async_database, "get_memberships", get_memberships)
+
+    async def scenario():
+        action_queue = ActionQueue(bucket_interval=0)
+        reconciler = Reconciler(action_queue)
+        action_queue.edit_member(member, add_roles=(guild.get_role(10),))
+        assert not await reconciler.diff(guild)
+        await action_queue.drain()
+        assert not action_queue.has_pending_edit(guild.id, member.id)
+        return await reconciler.diff(guild)
+
+    assert asyncio.run(scenario()).missing_roles == {100: {10}}
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import multiprocessing
+
+from settings_service import SettingsService
+
+
+def _stored(path) -> dict:
+    with open(path, "r", encoding="utf-8") as settings_file:
+        return json.load(settings_file)
+
+
+def _store(path, settings: dict):
+    with open(path, "w", encoding="utf-8") as settings_file:
+        json.dump(settings, settings_file)
+
+
+def test_legacy_setting_is_kept_by_other_processes(tmp_path):
+    path = tmp_path / "settings.json"
+    _store(path, {"admin_channel_id": 5})
+    SettingsService(str(path))._write({"2": {"admin_channel_id": 6}})
+    assert _stored(path) == {"admin_channel_id": 5, "guilds": {"2": {"admin_channel_id": 6}}}
+
+
+def test_legacy_setting_is_adopted_by_the_first_guild(tmp_path):
+    path = tmp_path / "settings.json"
+    _store(path, {"admin_channel_id": 5, "guilds": {"2": {"admin_channel_id": 6}}})
+    service = SettingsService(str(path))
+    service.adopt_legacy_settings(1)
+    assert service.admin_channel_id(1) == 5
+    assert _stored(path) == {"guilds": {"1": {"admin_channel_id": 5}, "2": {"admin_channel_id": 6}}}
+
+
+def test_write_merges_guilds_written_by_other_processes(tmp_path):
+    path = tmp_path / "settings.json"
+    service = SettingsService(str(path))
+    _store(path, {"guilds": {"1": {"admin_channel_id": 5}, "2": {"admin_channel_id": 6}}})
+    service._write({"2": {"admin_channel_id": 7}, "3": {"admin_channel_id": 8}})
+    assert _stored(path) == {"guilds": {"1": {"admin_channel_id": 5}, "2": {"admin_channel_id": 7},
+                                        "3": {"admin_channel_id": 8}}}
+    assert sorted(entry.name for entry in tmp_path.iterdir()) == ["settings.json", "settings.json.lock"]
+
+
+def _write_guild_repeatedly(path: str, guild_id: int):
+    service = SettingsService(path)
+    for channel_id in range(50):
+        service._write({str(guild_id): {"admin_channel_id": channel_id}})
+
+
+def test_concurrent_processes_keep_each_others_guilds(tmp_path):
+    path = str(tmp_path / "settings.json")
+    processes = [multiprocessing.get_context("fork").Process(target=_write_guild_repeatedly, args=(path, guild_id))
+                 for guild_id in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert _stored(path) == {"guilds": {str(guild_id): {"admin_channel_id": 49} for guild_id in range(4)}}
+
+
+def test_changes_are_coalesced_into_one_write(tmp_path, monkeypatch):
+    service = SettingsService(str(tmp_path / "settings.json"), debounce=0)
+    writes = []
+    monkeypatch.setattr(service, "_write", writes.append)
+
+    async def scenario():
+        service.set_admin_channel_id(1, 5)
+        service.set_admin_channel_id(1, 6)
+        service.set_admin_channel_id(2, 7)
+        await service.flush()
+
+    asyncio.run(scenario())
+    assert writes == [{"1": {"admin_channel_id": 6}, "2": {"admin_channel_id": 7}}]
@@ -0,0 +1,83 @@
+import pytest
+
+import database
+import transfer
+
+
+@pytest.fixture
+def guild_database(tmp_path):
+    guild_database = database.GuildDatabase(1, database.connect(str(tmp_path / "guild.sqlite")))
+    guild_database.init_database()
+    guild_database.load_cache()
+    yield guild_database
+    guild_database.con.close()
+
+
+def test_validate_accepts_records():
+    assert transfer._validate({"type": "org", "id": "10", "name": "Miners"}) == ("org", 10, "Miners", None, None)
+    assert transfer._validate({"type": "user", "id": 1}) == ("user", 1, None, None, None)
+    assert transfer._validate({"type": "membership", "id": 1, "org_id": 10, "level": "2"}) == \
+        ("membership", 1, None, 10, 2)
+
+
+@pytest.mark.parametrize("row, error", [
+    ({"type": "org", "id": 10}, "org name is missing"),
+    ({"type": "user", "id": 1, "name": "x" * 33}, "user name is longer than 32 characters"),
+    ({"type": "membership", "id": 1, "org_id": 10, "level": 4}, "permission level has to be between 0 and 3"),
+    ({"type": "membership", "id": "one", "org_id": 10}, "invalid membership record"),
+    ({"type": "guild", "id": 1}, "unknown record type 'guild'"),
+])
+def test_validate_rejects_records(row, error):
+    assert transfer._validate(row) == error
+
+
+def test_validate_checks_org_ids_against_roles():
+    assert transfer._validate({"type": "org", "id": 11, "name": "Traders"}, {10}) == \
+        "org 11 does not match any role of the guild"
+
+
+def test_parse_records_reports_line_numbers():
+    jsonl = ['{"type": "org", "id": 10, "name": "Miners"}\n', "\n", "not json\n", "[1]\n"]
+    assert list(transfer.parse_records(jsonl, "jsonl")) == [
+        (1, ("org", 10, "Miners", None, None)), (3, "invalid JSON"), (4, "record is not a JSON object")]
+    csv_lines = ["type,id,name,org_id,level\n", "user,1,Nick,,\n", "membership,1,,10,1\n"]
+    assert list(transfer.parse_records(csv_lines, "csv")) == [
+        (2, ("user", 1, "Nick", None, None)), (3, ("membership", 1, None, 10, 1))]
+
+
+def test_exported_records_import_unchanged(guild_database):
+    lines = ['{"type": "org", "id": 10, "name": "Miners"}', '{"type": "user", "id": 1, "name": "Nick"}',
+             '{"type": "membership", "id": 1, "org_id": 10, "level": 2}']
+    transfer.import_lines(guild_database, lines, "jsonl", dry_run=False)
+    for file_format in transfer.FORMATS:
+        exported = list(transfer.format_records(guild_database.export_records(), file_format))
+        diff = transfer.import_lines(guild_database, exported, file_format, dry_run=True)
+        assert diff.error_count == 0
+        assert all(counts["added"] == counts["changed"] == 0 for counts in diff.counts.values())
+
+
+def test_import_diff_counts_and_renames(guild_database):
+    transfer.import_lines(guild_database, ['{"type": "org", "id": 10, "name": "Miners"}'], "jsonl", dry_run=False)
+    lines = ['{"type": "org", "id": 10, "name": "Deep miners"}', '{"type": "org", "id": 11, "name": "Traders"}',
+             '{"type": "user", "id": 1}', '{"type": "membership", "id": 1, "org_id": 11, "level": 1}']
+    diff = transfer.import_lines(guild_database, lines, "jsonl", dry_run=True, role_ids={10, 11})
+    assert diff.counts["org"] == {"added": 1, "changed": 1, "unchanged": 0}
+    assert diff.counts["membership"]["added"] == 1
+    assert diff.renamed_orgs == {10: "Deep miners"}
+    assert guild_database.get_org(10).name == "Miners"
+
+
+def test_invalid_records_reject_the_whole_import(guild_database):
+    lines = ['{"type": "org", "id": 10, "name": "Miners"}', '{"type": "membership", "id": 1, "org_id": 12}']
+    with pytest.raises(database.ImportRejected) as rejected:
+        transfer.import_lines(guild_database, lines, "jsonl", dry_run=False)
+    assert rejected.value.diff.errors == ["line 2: unknown org 12, orgs have to be listed before their memberships"]
+    assert guild_database.get_org(10) is None
+
+
+def test_org_names_have_to_be_unique_within_the_file(guild_database):
+    lines = ['{"type": "org", "id": 10, "name": "Miners"}', '{"type": "org", "id": 11, "name": "Miners"}',
+             '{"type": "org", "id": 10, "name": "Deep miners"}', '{"type": "org", "id": 12, "name": "Miners"}']
+    diff = transfer.import_lines(guild_database, lines, "jsonl", dry_run=True)
+    assert diff.errors == ["line 2: org name 'Miners' is already used by another org"]
+    assert diff.counts["org"]["added"] == 2
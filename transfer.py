@@ -0,0 +1,119 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import tempfile
+from itertools import chain
+from typing import Iterable, Iterator, BinaryIO
+
+import database
+
+FORMATS = ("jsonl", "csv")
+FIELDS = ("type", "id", "name", "org_id", "level")
+_NAME_LIMITS = {"org": 128, "user": 32}
+
+
+def detect_format(file_name: str) -> str:
+    return "csv" if file_name.lower().endswith(".csv") else "jsonl"
+
+
+def format_records(records: Iterable[tuple], file_format: str) -> Iterator[str]:
+    if file_format == "jsonl":
+        for record in records:
+            yield json.dumps({field: value for field, value in zip(FIELDS, record) if value is not None},
+                             ensure_ascii=False) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chain((FIELDS,), records):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+# Passing the guild's role IDs rejects orgs without a matching Discord role, which the command line cannot check
+def parse_records(lines: Iterable[str], file_format: str, role_ids: set[int] = None) \
+        -> Iterator[tuple[int, tuple | str]]:
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, _validate(row, role_ids)
+        return
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_number, "invalid JSON"
+            continue
+        yield line_number, _validate(row, role_ids) if isinstance(row, dict) else "record is not a JSON object"
+
+
+def _validate(row: dict, role_ids: set[int] = None) -> tuple | str:
+    kind = row.get("type")
+    try:
+        if kind in _NAME_LIMITS:
+            name = row.get("name") or None
+            if kind == "org" and not name:
+                return "org name is missing"
+            if name and len(name) > _NAME_LIMITS[kind]:
+                return f"{kind} name is longer than {_NAME_LIMITS[kind]} characters"
+            if kind == "org" and role_ids is not None and int(row["id"]) not in role_ids:
+                return f"org {row['id']} does not match any role of the guild"
+            return kind, int(row["id"]), name, None, None
+        if kind == "membership":
+            permission_level = int(row.get("level") or 0)
+            if not 0 <= permission_level <= 3:
+                return "permission level has to be between 0 and 3"
+            return kind, int(row["id"]), None, int(row["org_id"]), permission_level
+    except (KeyError, TypeError, ValueError):
+        return f"invalid {kind} record"
+    return f"unknown record type '{kind}'"
+
+
+def export_to_file(guild_database: database.GuildDatabase, file_format: str) -> BinaryIO:
+    export_file = tempfile.TemporaryFile()
+    for chunk in format_records(guild_database.export_records(), file_format):
+        export_file.write(chunk.encode("utf-8"))
+    export_file.seek(0)
+    return export_file
+
+
+def import_lines(guild_database: database.GuildDatabase, lines: Iterable[str], file_format: str,
+                 dry_run: bool, role_ids: set[int] = None) -> database.ImportDiff:
+    return guild_database.import_records(parse_records(lines, file_format, role_ids), dry_run)
+
+
+# Run with the bot stopped, as a running bot does not see rows imported behind its cache
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a guild's orgs, users and memberships to or from a file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument("guild_id", type=int)
+    export_parser.add_argument("--output", help="defaults to standard output")
+    export_parser.add_argument("--format", choices=FORMATS)
+    import_parser = subparsers.add_parser("import")
+    import_parser.add_argument("guild_id", type=int)
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=FORMATS)
+    import_parser.add_argument("--dry-run", action="store_true")
+    arguments = parser.parse_args()
+
+    guild_database = database.for_guild(arguments.guild_id)
+    if arguments.command == "export":
+        file_format = arguments.format or detect_format(arguments.output or "")
+        output = open(arguments.output, "w", encoding="utf-8", newline="") if arguments.output else sys.stdout
+        with output:
+            output.writelines(format_records(guild_database.export_records(), file_format))
+    else:
+        with open(arguments.file, "r", encoding="utf-8", newline="") as input_file:
+            try:
+                diff = import_lines(guild_database, input_file, arguments.format or detect_format(arguments.file),
+                                    arguments.dry_run)
+            except database.ImportRejected as rejected:
+                diff = rejected.diff
+        print(("Dry run, nothing was written:\n" if arguments.dry_run else "") + diff.summary())
+        sys.exit(1 if diff.error_count else 0)